@@ -2,35 +2,84 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from config import Config
+from app.cache import PageCache
+from app.site import SiteContextCache
+from app.metrics import Metrics
+from app.users import UserCache
+from app.compression import Compression
+from app.jobs import JobQueue
+from app.database import RoutingSession, configure_engines, init_engines
+from app.stats import init_stats
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
+page_cache = PageCache()
+site_context = SiteContextCache()
+metrics = Metrics()
+user_cache = UserCache()
+compression = Compression()
+jobs = JobQueue()
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # Compiled templates survive restarts and are shared by the workers
+    from app.templating import init_bytecode_cache
+    init_bytecode_cache(app)
+
     # Initialize extensions
+    configure_engines(app)
     db.init_app(app)
+    init_engines(app)
+    init_stats(app)
     login_manager.init_app(app)
+    page_cache.init_app(app)
+    site_context.init_app(app)
+    metrics.init_app(app)
+    user_cache.init_app(app)
+    compression.init_app(app)
+    jobs.init_app(app)
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Veuillez vous connecter pour accéder à cette page.'
 
-    # User loader for Flask-Login
-    from app.models import User
+    # User loader for Flask-Login, served from the user cache
+    login_manager.user_loader(user_cache.load)
 
-    @login_manager.user_loader
-    def load_user(user_id):
-        return User.query.get(int(user_id))
+    # Template helpers
+    from app.images import media_url, media_srcset
+    app.add_template_global(media_url)
+    app.add_template_global(media_srcset)
+    from app.assets import theme_stylesheet_url, serve_precompressed_theme
+    app.add_template_global(theme_stylesheet_url)
+    app.before_request(serve_precompressed_theme)
 
     # Register blueprints
-    from app.routes import main, auth, admin
+    from app.routes import main, auth, admin, media, api
     app.register_blueprint(main.bp)
+    app.register_blueprint(api.bp)
+    app.register_blueprint(media.bp)
     app.register_blueprint(auth.bp)
     app.register_blueprint(admin.bp)
 
-    # Create database tables
-    with app.app_context():
-        db.create_all()
+    # Sitemaps and feed are only cached on the canonical address of the site
+    from app.sitemaps import check_site_url
+    check_site_url(app)
+
+    # CLI commands
+    from app.cli import db_cli, search_cli, jobs_cli, media_cli, export_static_command, precompile_templates_command
+    app.cli.add_command(db_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(media_cli)
+    app.cli.add_command(export_static_command)
+    app.cli.add_command(precompile_templates_command)
+
+    # Schema changes are applied by `flask db upgrade` at deploy time,
+    # not by every worker on boot
+    if app.config.get('SCHEMA_AUTO_UPGRADE'):
+        from app.migrations import upgrade
+        with app.app_context():
+            upgrade(log=app.logger.info)
 
     return app
@@ -0,0 +1,79 @@
+"""Theme stylesheet compiled to a static file named by its content hash"""
+import hashlib
+import os
+import tempfile
+from flask import current_app, render_template, request, send_file, url_for
+from app.compression import compress, STORED
+from app.http_cache import make_immutable
+
+THEME_DIR = 'theme'
+
+# Content-Encoding of each precompressed variant, by preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_precompressed(path, data):
+    """Write a static file along with its .br and .gz variants"""
+    _write_atomic(path, data)
+    for encoding, suffix in ENCODINGS:
+        compressed = compress(data, encoding, STORED)
+        if compressed is not None and len(compressed) < len(data):
+            _write_atomic(path + suffix, compressed)
+
+
+def theme_stylesheet(theme):
+    """Static filename of the stylesheet of a theme, compiled if missing
+
+    Files are never rewritten: a color change gives a new name, and pages
+    still cached elsewhere keep pointing to the stylesheet they were
+    rendered with.
+    """
+    css = render_template('assets/theme.css', theme=theme).encode('utf-8')
+    filename = f'{THEME_DIR}/theme-{hashlib.sha256(css).hexdigest()[:16]}.css'
+    path = os.path.join(current_app.static_folder, filename)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_precompressed(path, css)
+    return filename
+
+
+def theme_stylesheet_url():
+    """URL of the current theme stylesheet (template global)"""
+    from app import site_context
+    return url_for('static', filename=site_context.get().stylesheet)
+
+
+def serve_precompressed_theme():
+    """Serve compiled stylesheets with the best encoding the client accepts"""
+    if request.endpoint != 'static':
+        return None
+    filename = (request.view_args or {}).get('filename', '')
+    if not filename.startswith(f'{THEME_DIR}/') or '..' in filename:
+        return None
+    path = os.path.join(current_app.static_folder, filename)
+    if not os.path.isfile(path):
+        return None
+
+    encoding = None
+    for candidate, suffix in ENCODINGS:
+        if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+            encoding, path = candidate, path + suffix
+            break
+
+    response = send_file(path, mimetype='text/css', conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return make_immutable(response)
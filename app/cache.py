@@ -0,0 +1,217 @@
+"""Cache backends and the rendered HTML cache for the public pages"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, session, make_response
+from flask_login import current_user
+
+
+class NullCache:
+    """Backend that never stores anything (cache disabled)"""
+
+    shared = True
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache:
+    """In-process LRU cache bounded by a number of entries"""
+
+    # Each worker has its own copy, flushed when the site version moves
+    shared = False
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return None
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileSystemCache:
+    """Cache stored as files in a directory shared by every worker"""
+
+    shared = True
+    suffix = '.cache'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name + self.suffix)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError):
+            # Truncated or corrupted entry, treat it as a miss
+            return None
+
+    def set(self, key, value):
+        # Write to a temporary file then rename so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.suffix):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    pass
+
+
+def create_backend(app, prefix, default_dir):
+    """Backend selected by the <prefix>_TYPE, _MAX_ENTRIES and _DIR settings"""
+    cache_type = app.config.get(f'{prefix}_TYPE', 'memory')
+    if cache_type == 'memory':
+        return MemoryCache(app.config.get(f'{prefix}_MAX_ENTRIES', 1024))
+    if cache_type == 'filesystem':
+        cache_dir = app.config.get(f'{prefix}_DIR') or os.path.join(app.instance_path, default_dir)
+        return FileSystemCache(cache_dir)
+    if cache_type == 'null':
+        return NullCache()
+    raise ValueError(f'Unknown {prefix}_TYPE: {cache_type}')
+
+
+class PageCache:
+    """Cache of the HTML rendered for anonymous visitors, keyed by page slug"""
+
+    # Response headers stored with the body and sent again on cache hits
+    replayed_headers = ('ETag', 'Last-Modified', 'Cache-Control', 'Vary')
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self._site_version = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = create_backend(app, 'PAGE_CACHE', 'page_cache')
+        app.extensions['page_cache'] = self
+
+    @staticmethod
+    def key_for(slug=None):
+        """Cache key of a public page, the homepage when slug is None"""
+        return 'index' if slug is None else f'page/{slug}'
+
+    def invalidate_page(self, slug):
+        """Drop the cached rendering of a single page"""
+        self.backend.delete(self.key_for(slug))
+        if slug == 'home':
+            # The homepage renders the 'home' page too
+            self.backend.delete(self.key_for())
+
+    def clear(self):
+        """Drop every cached page (theme or menu changed)"""
+        self.backend.clear()
+
+    def _sync_site_version(self):
+        """Flush a per-process backend when another worker changed the site"""
+        from app import site_context
+        version = site_context.current_version()
+        if version != self._site_version:
+            self.backend.clear()
+            self._site_version = version
+
+    @staticmethod
+    def is_cacheable_request():
+        """Whether the response is the same for every visitor of this URL"""
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        # Pending flash messages are rendered into the page
+        if '_flashes' in session:
+            return False
+        return not current_user.is_authenticated
+
+    def cached(self, f):
+        """Serve a public view from the cache for anonymous visitors"""
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            from app import compression, site_context
+            if not self.is_cacheable_request():
+                return f(*args, **kwargs)
+
+            if not self.backend.shared:
+                self._sync_site_version()
+
+            # Entries carry the site version they were rendered with: a worker
+            # still on an older version neither serves nor overwrites them
+            version = site_context.current_version()
+            key = self.key_for(kwargs.get('slug'))
+            entry = self.backend.get(key)
+            if entry is not None and entry.get('version', 0) > version:
+                # Another worker already saw a newer version, catch up now
+                site_context.expire()
+                version = site_context.current_version()
+            if entry is not None and entry.get('version') == version:
+                response = make_response(entry['body'])
+                response.headers.extend(entry.get('headers', ()))
+                compression.use_variant(response, entry.get('encoded'))
+                return response.make_conditional(request)
+
+            response = make_response(f(*args, **kwargs))
+            newer = entry is not None and entry.get('version', 0) > version
+            if response.status_code == 200 and not response.direct_passthrough and not newer:
+                headers = [(name, value) for name, value in response.headers
+                           if name in self.replayed_headers]
+                body = response.get_data()
+                # Compressed once here instead of on every hit
+                encoded = compression.encode_variants(body) if compression.is_compressible(response) else {}
+                self.backend.set(key, {'body': body, 'headers': headers, 'encoded': encoded,
+                                       'version': version})
+                compression.use_variant(response, encoded)
+            return response
+        return decorated_function
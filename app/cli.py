@@ -0,0 +1,132 @@
+"""Flask CLI commands (flask db ..., flask search ..., flask jobs ..., flask media ..., export and deploy helpers)"""
+import click
+from flask.cli import AppGroup
+
+db_cli = AppGroup('db', help='Database schema management.')
+search_cli = AppGroup('search', help='Full-text search index.')
+jobs_cli = AppGroup('jobs', help='Background job queue.')
+media_cli = AppGroup('media', help='Uploaded media files.')
+
+
+@db_cli.command('upgrade')
+def upgrade_command():
+    """Apply pending schema migrations."""
+    from app.migrations import upgrade, latest_version
+    applied = upgrade(log=click.echo)
+    if applied:
+        click.echo(f'Database upgraded to version {applied[-1]}.')
+    else:
+        click.echo(f'Database is up to date (version {latest_version()}).')
+
+
+@db_cli.command('current')
+def current_command():
+    """Show the schema version of the database."""
+    from app import db
+    from app.migrations import current_version, latest_version
+    with db.engine.connect() as connection:
+        version = current_version(connection)
+    click.echo(f'Current version: {version} (latest: {latest_version()})')
+
+
+@db_cli.command('check-indexes')
+def check_indexes_command():
+    """Fail if a hot query shape scans a table (SQLite only)."""
+    from app import db
+    from app.migrations import hot_queries, explain, is_full_scan, is_seek
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('EXPLAIN QUERY PLAN checks require SQLite.')
+
+    failures = 0
+    for name, query in hot_queries().items():
+        query, index = query if isinstance(query, tuple) else (query, None)
+        plan = explain(query)
+        scans = [line for line in plan if is_full_scan(line)]
+        if index is not None and not any(is_seek(line, index) for line in plan):
+            scans.append(f'no range search on {index}')
+        status = 'FAIL' if scans else 'ok'
+        click.echo(f'[{status}] {name}: ' + ' | '.join(plan))
+        failures += bool(scans)
+    if failures:
+        raise click.ClickException(f'{failures} hot query shape(s) without a usable index.')
+
+
+@db_cli.command('reconcile-stats')
+def reconcile_stats_command():
+    """Recount the dashboard counters from the tables."""
+    from app import db
+    from app.stats import FIELDS, reconcile
+    with db.engine.begin() as connection:
+        stored, counts = reconcile(connection)
+    for name in FIELDS:
+        before = stored[name] if stored else None
+        status = 'ok' if before == counts[name] else f'was {before}'
+        click.echo(f'{name}: {counts[name]} ({status})')
+
+
+
+@search_cli.command('rebuild')
+def search_rebuild_command():
+    """Re-index every page (after imports or bulk edits)."""
+    from app import db
+    from app.search import is_supported, rebuild_search_index
+    if not is_supported(db.engine):
+        raise click.ClickException('Full-text search requires SQLite (FTS5).')
+    with db.engine.begin() as connection:
+        count = rebuild_search_index(connection)
+    click.echo(f'{count} page(s) indexed.')
+
+
+@jobs_cli.command('work')
+def jobs_work_command():
+    """Run queued jobs in the foreground until interrupted."""
+    from flask import current_app
+    from app import jobs
+    app = current_app._get_current_object()
+    jobs.start(app, daemon=False)
+    click.echo(f"Processing jobs with {app.config.get('JOBS_WORKERS', 2)} worker(s), Ctrl+C to stop.")
+    try:
+        while jobs.is_running():
+            jobs.join(1)
+    except KeyboardInterrupt:
+        click.echo('Stopping, waiting for running jobs...')
+    finally:
+        jobs.stop()
+        jobs.join()
+
+
+@jobs_cli.command('run-pending')
+def jobs_run_pending_command():
+    """Run every due job once, then exit (cron, deploy scripts)."""
+    from app import jobs
+    count = jobs.run_pending()
+    click.echo(f'{count} job(s) run.')
+
+
+@media_cli.command('backfill-references')
+def media_backfill_references_command():
+    """Rebuild the index of media embedded in pages from their content."""
+    from app import db
+    from app.references import rebuild_references
+    with db.engine.begin() as connection:
+        count = rebuild_references(connection)
+    click.echo(f'{count} reference(s) recorded.')
+
+
+@click.command('export-static')
+@click.argument('output_dir', type=click.Path(file_okay=False))
+@click.option('--workers', '-w', type=int, default=None, help='Rendering processes (default: CPU count).')
+@click.option('--force', is_flag=True, help='Re-render every page, ignoring the manifest.')
+def export_static_command(output_dir, workers, force):
+    """Render the public site to static files for a plain web server."""
+    from app.export import export_site
+    export_site(output_dir, workers=workers, force=force, log=click.echo)
+
+
+@click.command('precompile-templates')
+def precompile_templates_command():
+    """Compile every template into the bytecode cache (run at deploy)."""
+    from flask import current_app
+    from app.templating import precompile_templates
+    count = precompile_templates(current_app)
+    click.echo(f'{count} template(s) compiled.')
@@ -0,0 +1,171 @@
+"""gzip/brotli response compression negotiated with Accept-Encoding
+
+Responses are compressed on the fly in an after_request hook. Cached
+pages store their compressed variants next to the rendered body (see
+PageCache), which are sent as they are without compressing again.
+"""
+import gzip
+import os
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only
+    brotli = None
+
+# Preferred first; brotli is skipped when the module is missing
+ENCODINGS = ('br', 'gzip')
+
+# (gzip level, brotli quality): cheap for each response, stronger for
+# variants compressed once and served many times
+ON_THE_FLY = (6, 4)
+STORED = (9, 9)
+
+DEFAULT_MIMETYPES = (
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+    'application/json', 'application/javascript', 'application/xml', 'application/atom+xml',
+    'image/svg+xml',
+)
+
+
+def compress(data, encoding, levels=ON_THE_FLY):
+    """Compress bytes, None if the encoding is unavailable"""
+    gzip_level, brotli_quality = levels
+    if encoding == 'gzip':
+        # mtime=0 keeps the output identical for identical input
+        return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=brotli_quality)
+    return None
+
+
+def available_encodings():
+    return tuple(e for e in ENCODINGS if e != 'br' or brotli is not None)
+
+
+def negotiate(available=None):
+    """Best encoding accepted by the client among the available ones"""
+    for encoding in available if available is not None else available_encodings():
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def _stream(chunks, encoding, levels=ON_THE_FLY):
+    """Compress an iterable of chunks, flushing after each one"""
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(levels[0], zlib.DEFLATED, 31)  # 31: gzip container
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    else:
+        compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=levels[1])
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+
+
+def compress_file(source, destination, encoding, levels=STORED, chunk_size=64 * 1024):
+    """Write the compressed copy of a file without reading it whole"""
+    if encoding not in available_encodings():
+        return False
+
+    def chunks():
+        with open(source, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    tmp_path = destination + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        for data in _stream(chunks(), encoding, levels):
+            out.write(data)
+    os.replace(tmp_path, destination)
+    return True
+
+
+def _weaken_etag(response):
+    # The same strong ETag must not name two different byte sequences;
+    # weak comparison keeps If-None-Match working for every variant
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response.headers['ETag'] = 'W/' + etag
+
+
+class Compression:
+    """Compress eligible responses according to Accept-Encoding"""
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.min_size = 500
+        self.mimetypes = set(DEFAULT_MIMETYPES)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('COMPRESSION_ENABLED', True)
+        self.min_size = app.config.get('COMPRESSION_MIN_SIZE', 500)
+        self.mimetypes = set(app.config.get('COMPRESSION_MIMETYPES') or DEFAULT_MIMETYPES)
+        app.extensions['compression'] = self
+        app.after_request(self.compress_response)
+
+    def is_compressible(self, response):
+        """Whether a response is of a kind that compression helps"""
+        return (self.enabled
+                and response.status_code == 200
+                and response.mimetype in self.mimetypes
+                and 'Content-Encoding' not in response.headers
+                and not response.direct_passthrough
+                and not response.cache_control.no_transform)
+
+    def encode_variants(self, body):
+        """Compressed variants of a body worth storing, by encoding"""
+        if not self.enabled or len(body) < self.min_size:
+            return {}
+        variants = {}
+        for encoding in available_encodings():
+            data = compress(body, encoding, STORED)
+            if data is not None and len(data) < len(body):
+                variants[encoding] = data
+        return variants
+
+    def use_variant(self, response, variants):
+        """Send a stored variant if the client accepts one, returns the response"""
+        if variants:
+            response.vary.add('Accept-Encoding')
+            encoding = negotiate(tuple(e for e in ENCODINGS if e in variants))
+            if encoding is not None:
+                response.set_data(variants[encoding])
+                response.headers['Content-Encoding'] = encoding
+                _weaken_etag(response)
+        return response
+
+    def compress_response(self, response):
+        if not self.is_compressible(response):
+            return response
+
+        if response.is_streamed:
+            encoding = negotiate()
+            response.vary.add('Accept-Encoding')
+            if encoding is not None:
+                response.response = _stream(response.iter_encoded(), encoding)
+                response.headers.pop('Content-Length', None)
+                response.headers['Content-Encoding'] = encoding
+                _weaken_etag(response)
+            return response
+
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate()
+        if encoding is not None:
+            data = compress(body, encoding)
+            if len(data) < len(body):
+                response.set_data(data)
+                response.headers['Content-Encoding'] = encoding
+                _weaken_etag(response)
+        return response
@@ -0,0 +1,108 @@
+"""Database engines: connection pragmas, pool sizing and read replica routing
+
+SQLite connections get their pragmas (WAL journal, synchronous, cache and
+mmap sizes, busy timeout) when they are opened, so readers keep working
+while an admin save is being written. Other databases get a sized,
+pre-pinged connection pool. When DATABASE_REPLICA_URL is set, the views
+wrapped in read_replica() run their queries on that bind; writes and
+every other view use the primary.
+"""
+from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND = 'replica'
+
+
+def _is_sqlite(url):
+    return make_url(url).get_backend_name() == 'sqlite'
+
+
+def _pool_options(config):
+    return {
+        'pool_size': config.get('DB_POOL_SIZE', 5),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': True,
+    }
+
+
+def configure_engines(app):
+    """Fill in engine options and the replica bind, before db.init_app()"""
+    config = app.config
+    if not _is_sqlite(config['SQLALCHEMY_DATABASE_URI']):
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = {**_pool_options(config),
+                                               **config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+
+    replica_url = config.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        replica = {'url': replica_url}
+        if not _is_sqlite(replica_url):
+            replica.update(_pool_options(config))
+        binds.setdefault(REPLICA_BIND, replica)
+        config['SQLALCHEMY_BINDS'] = binds
+
+
+def sqlite_pragmas(config):
+    """PRAGMA statements run on each new SQLite connection"""
+    pragmas = {
+        'journal_mode': config.get('SQLITE_JOURNAL_MODE'),
+        'synchronous': config.get('SQLITE_SYNCHRONOUS'),
+        'busy_timeout': config.get('SQLITE_BUSY_TIMEOUT'),
+        'cache_size': config.get('SQLITE_CACHE_SIZE'),
+        'mmap_size': config.get('SQLITE_MMAP_SIZE'),
+    }
+    return [f'PRAGMA {name}={value}' for name, value in pragmas.items() if value not in (None, '')]
+
+
+def init_engines(app):
+    """Apply the SQLite pragmas to every SQLite engine, after db.init_app()"""
+    from app import db
+    statements = sqlite_pragmas(app.config)
+    if not statements:
+        return
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', set_pragmas)
+
+
+class RoutingSession(Session):
+    """Session sending the reads of read_replica() views to the replica bind"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and self.info.get('read_replica') and not self._flushing
+                and not getattr(clause, 'is_dml', False)):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_replica(view):
+    """Run the queries of a read-only view on the replica, when configured
+
+    The replica may lag behind the primary: only use it for public pages
+    where seeing an admin change a moment later is acceptable.
+    """
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        from app import db
+        db.session.info['read_replica'] = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            db.session.info.pop('read_replica', None)
+    return decorated
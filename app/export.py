@@ -0,0 +1,209 @@
+"""Static export of the public site (rendered HTML + referenced media)
+
+Pages are rendered through the regular templates into an output directory
+laid out for a plain web server (index.html, page/<slug>/index.html,
+media/..., and static/uploads/... for links written before the /media
+route). A manifest records, for every page, the updated_at it was
+rendered from and the hash of its HTML, so later runs only re-render
+pages that changed, or everything when the theme, menu or templates did.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, render_template
+
+MANIFEST_NAME = 'manifest.json'
+BATCH_SIZE = 500
+# Bumped when the manifest entries change meaning, forces a full rebuild
+MANIFEST_FORMAT = 2
+
+# Set in the parent before forking the worker pool
+_app = None
+
+
+def _template_fingerprint(app):
+    """Hash of the template sources, so deploys with new templates re-render"""
+    digest = hashlib.sha256()
+    for root, _, files in sorted(os.walk(app.jinja_loader.searchpath[0])):
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(name.encode('utf-8'))
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _site_key(site, app):
+    theme = site.theme
+    parts = [
+        str(MANIFEST_FORMAT),
+        repr(tuple(theme)) if theme else '',
+        site.menu_digest,
+        _template_fingerprint(app),
+    ]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _output_path(slug):
+    return 'index.html' if slug is None else os.path.join('page', slug, 'index.html')
+
+
+def _write_html(output_dir, relative_path, html):
+    data = html.encode('utf-8')
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = os.path.join(output_dir, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return sha256
+
+
+def _render_one(template, page, site):
+    return render_template(template, page=page, theme=site.theme, menu_pages=site.menu_pages,
+                           static_export=True)
+
+
+def render_batch(page_ids, output_dir):
+    """Render a batch of pages, returns their manifest entries and media references"""
+    from app import site_context
+    from app.models import Page
+
+    app = _app or current_app._get_current_object()
+    results = []
+    with app.test_request_context('/'):
+        site = site_context.get()
+        pages = Page.query.filter(Page.id.in_(page_ids), Page.is_published.is_(True)).all()
+        for page in pages:
+            with app.test_request_context(f'/page/{page.slug}'):
+                html = _render_one('pages/view.html', page, site)
+            path = _output_path(page.slug)
+            results.append((page.slug, {
+                'id': page.id,
+                'updated_at': page.updated_at.isoformat() if page.updated_at else None,
+                'path': path,
+                'sha256': _write_html(output_dir, path, html),
+                'media': _media_paths(html),
+            }))
+    return results
+
+
+def _media_paths(html):
+    """Output paths (media/..., or static/uploads/... for legacy URLs) of the uploads in some HTML"""
+    from app.images import MEDIA_URL
+    return sorted({prefix.strip('/') + '/' + filename for prefix, filename in MEDIA_URL.findall(html)})
+
+
+def _init_worker():
+    # Connections inherited from the parent must not be reused after fork
+    from app import db
+    with _app.app_context():
+        db.engine.dispose(close=False)
+
+
+def _load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _copy_media(output_dir, paths):
+    upload_folder = os.path.realpath(current_app.config['UPLOAD_FOLDER'])
+    copied = 0
+    for path in paths:
+        # Same file under /media and the legacy /static/uploads URL
+        filename = path.split('/', 2)[-1] if path.startswith('static/uploads/') else path.split('/', 1)[-1]
+        source = os.path.realpath(os.path.join(upload_folder, filename))
+        target = os.path.join(output_dir, path)
+        if not source.startswith(upload_folder + os.sep) or not os.path.isfile(source):
+            continue
+        if os.path.exists(target) and os.path.getsize(target) == os.path.getsize(source):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(source, target)
+        copied += 1
+    return copied
+
+
+def _copy_stylesheet(output_dir, filename):
+    source = os.path.join(current_app.static_folder, filename)
+    target = os.path.join(output_dir, 'static', filename)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    for suffix in ('', '.gz', '.br'):
+        if os.path.isfile(source + suffix) and not os.path.exists(target + suffix):
+            shutil.copy2(source + suffix, target + suffix)
+
+
+def export_site(output_dir, workers=None, force=False, log=print):
+    """Export every published page to output_dir, incrementally"""
+    global _app
+    from app import site_context
+    from app.models import Page
+
+    app = current_app._get_current_object()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = _load_manifest(output_dir)
+    old_pages = manifest.get('pages', {})
+
+    site = site_context.get()
+    site_key = _site_key(site, app)
+    full_rebuild = force or manifest.get('site') != site_key
+
+    published = Page.query.with_entities(Page.id, Page.slug, Page.updated_at).filter_by(is_published=True).all()
+    to_render = [
+        p.id for p in published
+        if full_rebuild
+        or p.slug not in old_pages
+        or old_pages[p.slug].get('updated_at') != (p.updated_at.isoformat() if p.updated_at else None)
+    ]
+    log(f'{len(published)} published pages, {len(to_render)} to render'
+        + (' (full rebuild)' if full_rebuild else ''))
+
+    pages = {slug: entry for slug, entry in old_pages.items()}
+    batches = [to_render[i:i + BATCH_SIZE] for i in range(0, len(to_render), BATCH_SIZE)]
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(batches) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        _app = app
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+            done = 0
+            for results in pool.map(render_batch, batches, [output_dir] * len(batches)):
+                pages.update(results)
+                done += len(results)
+                log(f'  {done}/{len(to_render)} pages rendered')
+        _app = None
+    else:
+        for batch in batches:
+            pages.update(render_batch(batch, output_dir))
+
+    # Homepage, always rendered: it is a single page
+    home = Page.query.filter_by(slug='home', is_published=True).first()
+    with app.test_request_context('/'):
+        html = _render_one('pages/index.html', home, site)
+    index_sha256 = _write_html(output_dir, _output_path(None), html)
+    index_media = set(_media_paths(html))
+
+    # Pages unpublished or deleted since the last run
+    published_slugs = {p.slug for p in published}
+    for slug in [s for s in pages if s not in published_slugs]:
+        path = os.path.join(output_dir, pages.pop(slug)['path'])
+        if os.path.exists(path):
+            os.remove(path)
+
+    media = index_media.union(*(entry.get('media', ()) for entry in pages.values()))
+    copied = _copy_media(output_dir, sorted(media))
+    _copy_stylesheet(output_dir, site.stylesheet)
+
+    manifest = {'site': site_key, 'index': index_sha256, 'pages': pages}
+    tmp_path = os.path.join(output_dir, MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, os.path.join(output_dir, MANIFEST_NAME))
+
+    log(f'Export done: {len(to_render)} rendered, {len(pages)} pages, {copied} media copied')
+    return manifest
@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField, FileAllowed
+from flask_wtf.file import FileField, FileAllowed, FileRequired, MultipleFileField
 from wtforms import StringField, PasswordField, TextAreaField, BooleanField, IntegerField, SubmitField
 from wtforms.validators import DataRequired, Email, Length, EqualTo, Optional, Regexp
 
@@ -37,6 +37,16 @@ class MediaUploadForm(FlaskForm):
     submit = SubmitField('Télécharger')
 
 
+class MediaBulkUploadForm(FlaskForm):
+    """Several media files, or zip archives of images, at once"""
+    files = MultipleFileField('Fichiers', validators=[
+        FileRequired(),
+        FileAllowed(['png', 'jpg', 'jpeg', 'gif', 'webp', 'svg', 'zip'], 'Images ou archives ZIP uniquement!')
+    ])
+    file_type = StringField('Type', default='image')
+    submit = SubmitField('Télécharger')
+
+
 class ThemeForm(FlaskForm):
     """Theme customization form"""
     site_name = StringField('Nom du site', validators=[DataRequired(), Length(max=200)])
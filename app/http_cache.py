@@ -0,0 +1,51 @@
+"""HTTP caching: validators for the public pages, policy for fingerprinted files"""
+import hashlib
+from flask import current_app, request
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def make_etag(*parts):
+    """Strong ETag built from the values a response depends on"""
+    data = '|'.join('' if part is None else str(part) for part in parts)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def latest(*timestamps):
+    """Most recent of the given timestamps, ignoring missing ones"""
+    timestamps = [t for t in timestamps if t is not None]
+    return max(timestamps) if timestamps else None
+
+
+def set_validators(response, etag, last_modified=None):
+    """Attach ETag, Last-Modified and the shared Cache-Control policy"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = current_app.config.get('PAGE_CACHE_CONTROL', 'public, no-cache')
+    # Logged-in visitors get a different rendering of the same URL
+    response.vary.add('Cookie')
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the client copy is still valid, else None
+
+    Meant to be called before rendering, so revalidation only costs the
+    lookups needed to compute the validators.
+    """
+    if not request.if_none_match and not request.if_modified_since:
+        return None
+    response = current_app.response_class()
+    set_validators(response, etag, last_modified)
+    response.make_conditional(request)
+    return response if response.status_code == 304 else None
+
+
+def make_immutable(response):
+    """Let browsers and proxies keep a response whose URL changes with its content"""
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
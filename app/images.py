@@ -0,0 +1,152 @@
+"""Resized derivatives (thumbnails, responsive widths) of uploaded images"""
+import os
+import re
+from flask import current_app, url_for
+from app.jobs import job, enqueue
+
+# Formats Pillow cannot resize meaningfully
+SKIPPED_MIME_TYPES = {'image/svg+xml'}
+
+# URL of an upload in HTML: /media/<filename>, or /static/uploads/<filename>
+# as written before uploads had their own route, relative or absolute.
+# Groups: the prefix ('/media/' or '/static/uploads/') and the filename
+MEDIA_URL = re.compile(r'(?:(?:https?:)?//[^/\s"\'<>]+|(?<![\w.-]))(/media/|/static/uploads/)([^"\'\s)?#<>]+)')
+
+
+def schedule_derivatives(media):
+    """Queue the generation of the derivatives of a flushed Media row
+
+    The job is part of the current transaction, the caller commits.
+    """
+    if media.mime_type in SKIPPED_MIME_TYPES:
+        return None
+    return enqueue('media.derivatives', media_id=media.id)
+
+
+@job('media.derivatives')
+def derivatives_job(media_id):
+    from app.models import Media
+    media = Media.query.get(media_id)
+    if media is None or media.derivatives:
+        return
+    if not _copy_from_duplicate(media):
+        generate_derivatives(media_id)
+
+
+def _copy_from_duplicate(media):
+    """Reuse the derivatives of another Media sharing the same blob"""
+    from app import db
+    from app.models import Media, MediaDerivative
+
+    if media.blob_sha256 is None:
+        return False
+    duplicate = Media.query.filter(Media.blob_sha256 == media.blob_sha256,
+                                   Media.id != media.id,
+                                   Media.derivatives.any()).first()
+    if duplicate is None:
+        return False
+
+    media.width, media.height = duplicate.width, duplicate.height
+    for d in duplicate.derivatives:
+        db.session.add(MediaDerivative(media=media, name=d.name, format=d.format,
+                                       filename=d.filename, file_path=d.file_path,
+                                       width=d.width, height=d.height, file_size=d.file_size))
+    db.session.commit()
+    return True
+
+
+def _prepare_for(image, fmt):
+    if fmt in ('jpeg', 'jpg'):
+        return image.convert('RGB')
+    if image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGBA')
+    return image
+
+
+def generate_derivatives(media_id):
+    """Create every configured size/format of an image and record them"""
+    from app import db, page_cache
+    from app.models import Media, MediaDerivative, Theme
+    from app.site import bump_site_version
+    # Pillow is only needed by the background workers
+    from PIL import Image, ImageOps
+
+    media = Media.query.get(media_id)
+    if media is None:
+        return
+
+    config = current_app.config
+    sizes = config.get('MEDIA_DERIVATIVE_SIZES', {})
+    # Maps extensions to Pillow writers, formats without a writer are skipped
+    writers = Image.registered_extensions()
+    formats = [f for f in config.get('MEDIA_DERIVATIVE_FORMATS', ['webp']) if f'.{f}' in writers]
+    quality = config.get('MEDIA_DERIVATIVE_QUALITY', 80)
+    stem = os.path.splitext(media.filename)[0]
+    path_stem = os.path.splitext(media.file_path)[0]
+
+    with Image.open(media.file_path) as original:
+        if getattr(original, 'is_animated', False):
+            return
+        image = ImageOps.exif_transpose(original)
+        media.width, media.height = image.size
+
+        for name, width in sorted(sizes.items(), key=lambda item: item[1]):
+            if width >= image.width:
+                # Never upscale, the original is served instead
+                continue
+            resized = image.copy()
+            resized.thumbnail((width, image.height), Image.LANCZOS)
+            for fmt in formats:
+                filename = f'{stem}_{name}.{fmt}'
+                file_path = f'{path_stem}_{name}.{fmt}'
+                _prepare_for(resized, fmt).save(file_path, writers[f'.{fmt}'], quality=quality, optimize=True)
+                db.session.add(MediaDerivative(
+                    media=media,
+                    name=name,
+                    format=fmt,
+                    filename=filename,
+                    file_path=file_path,
+                    width=resized.width,
+                    height=resized.height,
+                    file_size=os.path.getsize(file_path)
+                ))
+
+    # Public pages embed the logo, re-render them once it has derivatives
+    theme = Theme.query.first()
+    used_by_theme = theme is not None and media.id in (theme.logo_id, theme.favicon_id)
+    if used_by_theme:
+        bump_site_version()
+    db.session.commit()
+    if used_by_theme:
+        page_cache.clear()
+
+
+def _pick(media, size, fmt=None):
+    for derivative in media.derivatives or ():
+        if derivative.name == size and (fmt is None or derivative.format == fmt):
+            return derivative
+    return None
+
+
+def media_url(media, size=None, fmt=None, _external=False):
+    """URL of a media file, or of its derivative of the given size if it exists"""
+    filename = media.filename
+    if size is not None:
+        derivative = _pick(media, size, fmt)
+        if derivative is not None:
+            filename = derivative.filename
+    return url_for('media.file', filename=filename, _external=_external)
+
+
+def media_srcset(media, fmt=None):
+    """srcset attribute value listing the derivatives of a media file"""
+    if fmt is None:
+        formats = current_app.config.get('MEDIA_DERIVATIVE_FORMATS', ['webp'])
+        fmt = formats[0] if formats else None
+    candidates = [
+        f"{url_for('media.file', filename=d.filename)} {d.width}w"
+        for d in media.derivatives or () if d.format == fmt
+    ]
+    if candidates and getattr(media, 'width', None):
+        candidates.append(f"{url_for('media.file', filename=media.filename)} {media.width}w")
+    return ', '.join(candidates)
@@ -0,0 +1,270 @@
+"""Background jobs: persistent queue in the database, executed off the request
+
+Admin handlers call enqueue() before committing, so a job is recorded in
+the same transaction as the change that needs it and runs only if that
+change is committed. Each app process (every prefork worker, or a
+dedicated `flask jobs work` process) runs a dispatcher thread that claims
+due jobs with a conditional UPDATE, so a job runs once even with several
+processes, and hands them to a small thread pool. Failed jobs are retried
+with exponential backoff; jobs left running by a process that died are
+picked up again after JOBS_TIMEOUT.
+"""
+import atexit
+import os
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+
+HANDLERS = {}
+
+
+def job(name):
+    """Register a function as the handler of a job name
+
+    Handlers receive the payload as keyword arguments, run inside an app
+    context, and signal a failure (to be retried) by raising.
+    """
+    def decorator(f):
+        HANDLERS[name] = f
+        return f
+    return decorator
+
+
+def enqueue(name, delay=0, max_attempts=None, **payload):
+    """Add a job to the current transaction; it runs after the commit"""
+    from app import db
+    from app.models import Job
+    if max_attempts is None:
+        max_attempts = current_app.config.get('JOBS_MAX_ATTEMPTS', 5)
+    queued = Job(name=name, payload=payload, max_attempts=max_attempts,
+                 run_at=datetime.utcnow() + timedelta(seconds=delay))
+    db.session.add(queued)
+    db.session.info['jobs_enqueued'] = True
+    return queued
+
+
+def retry_delay(attempts, base, maximum):
+    """Seconds before the next attempt: exponential, capped, with jitter"""
+    delay = min(maximum, base * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.9, 1.1)
+
+
+class JobQueue:
+    """Per-process dispatcher of the persistent job queue"""
+
+    def __init__(self, app=None):
+        self._app = None
+        self._thread = None
+        self._executor = None
+        self._slots = None
+        self._wake = threading.Event()
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._pid = None
+        self._registered_exit = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['jobs'] = self
+        if app.config.get('JOBS_EXECUTOR', 'thread') == 'thread':
+            # Started in the process serving requests, never in a preloading master
+            app.before_request(self._ensure_started)
+
+        from sqlalchemy import event
+        from app import db
+        if not event.contains(db.session, 'after_commit', self._on_commit):
+            event.listen(db.session, 'after_commit', self._on_commit)
+
+    def _on_commit(self, session):
+        if session.info.pop('jobs_enqueued', False):
+            self._wake.set()
+
+    def _ensure_started(self):
+        if self._thread is None or self._pid != os.getpid():
+            self.start(current_app._get_current_object())
+
+    def start(self, app, daemon=True):
+        """Start the dispatcher thread of this process"""
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._app = app
+            self._pid = os.getpid()
+            self._stopping = False
+            workers = app.config.get('JOBS_WORKERS', 2)
+            self._slots = threading.BoundedSemaphore(workers)
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='jobs')
+            self._thread = threading.Thread(target=self._dispatch_loop, name='jobs-dispatcher', daemon=daemon)
+            self._thread.start()
+            if not self._registered_exit:
+                # The dispatcher is a daemon thread, killed mid-claim at exit
+                # unless stopped. atexit hooks run after concurrent.futures has
+                # joined the pool: running jobs have finished, and submit() now
+                # raises, so _dispatch_due() puts back what it claims meanwhile
+                atexit.register(self.stop)
+                self._registered_exit = True
+
+    def stop(self, wait=True):
+        """Stop claiming jobs and let the running ones finish"""
+        self._stopping = True
+        self._wake.set()
+        # The dispatcher may be handing over a job it just claimed
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def _dispatch_loop(self):
+        app = self._app
+        poll_interval = app.config.get('JOBS_POLL_INTERVAL', 1.0)
+        last_maintenance = 0.0
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    if time.monotonic() - last_maintenance > 60:
+                        self.requeue_stale()
+                        self.prune()
+                        last_maintenance = time.monotonic()
+                    self._dispatch_due()
+            except Exception:
+                app.logger.exception('Job dispatcher error')
+            self._wake.wait(poll_interval)
+
+    def _dispatch_due(self):
+        while not self._stopping and self._slots.acquire(blocking=False):
+            job_id = self.claim()
+            if job_id is None:
+                self._slots.release()
+                return
+            try:
+                self._executor.submit(self._run_and_release, job_id)
+            except RuntimeError:
+                # Pool shut down (interpreter exit, before stop() runs):
+                # leave the job to the next process
+                self._slots.release()
+                self.unclaim(job_id)
+                return
+
+    def _run_and_release(self, job_id):
+        try:
+            with self._app.app_context():
+                self.run(job_id)
+        finally:
+            self._slots.release()
+            self._wake.set()
+
+    def claim(self):
+        """Mark the next due job as running for this process, returns its id"""
+        from app import db
+        from app.models import Job
+        now = datetime.utcnow()
+        while True:
+            candidate = (db.session.query(Job.id)
+                         .filter(Job.status == 'pending', Job.run_at <= now)
+                         .order_by(Job.run_at, Job.id)
+                         .limit(1)
+                         .scalar())
+            if candidate is None:
+                db.session.rollback()
+                return None
+            # Another process may have claimed it since the SELECT
+            claimed = (Job.query
+                       .filter_by(id=candidate, status='pending')
+                       .update({Job.status: 'running', Job.started_at: now, Job.attempts: Job.attempts + 1},
+                               synchronize_session=False))
+            db.session.commit()
+            if claimed:
+                return candidate
+
+    def unclaim(self, job_id):
+        """Put a claimed job back in the queue without counting the attempt"""
+        from app import db
+        from app.models import Job
+        (Job.query
+         .filter_by(id=job_id, status='running')
+         .update({Job.status: 'pending', Job.started_at: None, Job.attempts: Job.attempts - 1},
+                 synchronize_session=False))
+        db.session.commit()
+
+    def run(self, job_id):
+        """Execute a claimed job and record its outcome"""
+        from app import db
+        from app.models import Job
+        config = current_app.config
+        queued = db.session.get(Job, job_id)
+        handler = HANDLERS.get(queued.name)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f'No handler for job {queued.name!r}')
+            handler(**(queued.payload or {}))
+        except Exception as e:
+            db.session.rollback()
+            queued = db.session.get(Job, job_id)
+            queued.last_error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+            if queued.attempts < queued.max_attempts:
+                queued.status = 'pending'
+                queued.run_at = datetime.utcnow() + timedelta(seconds=retry_delay(
+                    queued.attempts, config.get('JOBS_RETRY_DELAY', 5), config.get('JOBS_RETRY_MAX_DELAY', 3600)))
+                current_app.logger.warning('Job %s (%s) failed, attempt %s/%s: %s', job_id, queued.name,
+                                           queued.attempts, queued.max_attempts, queued.last_error)
+            else:
+                queued.status = 'failed'
+                current_app.logger.error('Job %s (%s) failed permanently: %s', job_id, queued.name,
+                                         queued.last_error)
+        else:
+            queued = db.session.get(Job, job_id)
+            queued.status = 'done'
+            queued.last_error = None
+        queued.finished_at = datetime.utcnow()
+        queued.duration_ms = (time.perf_counter() - started) * 1000
+        db.session.commit()
+        return queued.status
+
+    def requeue_stale(self):
+        """Put back jobs left running longer than JOBS_TIMEOUT (dead process)"""
+        from app import db
+        from app.models import Job
+        deadline = datetime.utcnow() - timedelta(seconds=current_app.config.get('JOBS_TIMEOUT', 600))
+        count = (Job.query
+                 .filter(Job.status == 'running', Job.started_at < deadline)
+                 .update({Job.status: 'pending'}, synchronize_session=False))
+        db.session.commit()
+        return count
+
+    def prune(self):
+        """Forget finished jobs older than JOBS_KEEP_DAYS"""
+        from app import db
+        from app.models import Job
+        cutoff = datetime.utcnow() - timedelta(days=current_app.config.get('JOBS_KEEP_DAYS', 7))
+        count = (Job.query
+                 .filter(Job.status == 'done', Job.finished_at < cutoff)
+                 .delete(synchronize_session=False))
+        db.session.commit()
+        return count
+
+    def run_pending(self):
+        """Run every due job in the calling thread, returns how many ran"""
+        count = 0
+        while True:
+            job_id = self.claim()
+            if job_id is None:
+                return count
+            self.run(job_id)
+            count += 1
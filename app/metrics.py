@@ -0,0 +1,183 @@
+"""Request-level instrumentation exposed in the Prometheus text format
+
+Flask request hooks time each request, SQLAlchemy engine events count and
+time its queries and the template signals time rendering. Figures are
+aggregated per endpoint and per process; a fraction of requests can be
+sampled to keep the overhead negligible in production.
+"""
+import random
+import threading
+import time
+from collections import Counter
+from flask import g, request, has_request_context, template_rendered, before_render_template
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class EndpointStats:
+    """Aggregated figures of one endpoint"""
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.query_seconds = 0.0
+        self.render_seconds = 0.0
+        self.n_plus_one = 0
+
+
+class RequestStats:
+    """Figures collected while a sampled request is being handled"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []  # (statement, seconds)
+        self.render_seconds = 0.0
+        self.render_started = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Per-process request, query and render metrics"""
+
+    def __init__(self, app=None):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['metrics'] = self
+        if not app.config.get('METRICS_ENABLED', True):
+            return
+
+        self.sample_rate = app.config.get('METRICS_SAMPLE_RATE', 1.0)
+        self.slow_request_ms = app.config.get('METRICS_SLOW_REQUEST_MS', 0)
+        self.n_plus_one_threshold = app.config.get('METRICS_N_PLUS_ONE_THRESHOLD', 10)
+        self.logger = app.logger
+
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+
+        from sqlalchemy import event
+        from app import db
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    # Hooks
+
+    def _before_request(self):
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            g.request_stats = RequestStats()
+
+    @staticmethod
+    def _current():
+        return g.get('request_stats') if has_request_context() else None
+
+    def _before_render(self, sender, template, context, **extra):
+        stats = self._current()
+        if stats is not None:
+            stats.render_started = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        stats = self._current()
+        if stats is not None and stats.render_started is not None:
+            stats.render_seconds += time.perf_counter() - stats.render_started
+            stats.render_started = None
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self._current() is not None:
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._current()
+        if stats is not None and conn.info.get('query_started'):
+            stats.queries.append((statement, time.perf_counter() - conn.info['query_started'].pop()))
+
+    def _teardown_request(self, exc):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return
+        elapsed = time.perf_counter() - stats.started
+        endpoint = request.endpoint or 'none'
+        query_seconds = sum(seconds for _, seconds in stats.queries)
+
+        repeated = [(statement, count) for statement, count
+                    in Counter(statement for statement, _ in stats.queries).most_common(1)
+                    if count >= self.n_plus_one_threshold]
+        if repeated:
+            self.logger.warning('Possible N+1 on %s: %d executions of %s',
+                                endpoint, repeated[0][1], repeated[0][0])
+
+        with self._lock:
+            endpoint_stats = self.endpoints.setdefault(endpoint, EndpointStats())
+            endpoint_stats.latency.observe(elapsed)
+            endpoint_stats.queries.observe(len(stats.queries))
+            endpoint_stats.query_seconds += query_seconds
+            endpoint_stats.render_seconds += stats.render_seconds
+            endpoint_stats.n_plus_one += bool(repeated)
+
+        if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+            lines = [f'  {seconds * 1000:.1f} ms  {statement}' for statement, seconds in stats.queries]
+            self.logger.warning('Slow request %s %s: %.0f ms, %d queries (%.0f ms), render %.0f ms\n%s',
+                                request.method, request.path, elapsed * 1000, len(stats.queries),
+                                query_seconds * 1000, stats.render_seconds * 1000, '\n'.join(lines))
+
+    # Export
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            items = sorted(self.endpoints.items())
+            lines = []
+
+            def histogram(name, help_text, attr):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for endpoint, stats in items:
+                    h = getattr(stats, attr)
+                    label = f'endpoint="{_escape(endpoint)}"'
+                    for bound, count in zip(h.buckets, h.counts):
+                        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{label},le="+Inf"}} {h.count}')
+                    lines.append(f'{name}_sum{{{label}}} {h.sum}')
+                    lines.append(f'{name}_count{{{label}}} {h.count}')
+
+            def counter(name, help_text, value_of):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for endpoint, stats in items:
+                    lines.append(f'{name}{{endpoint="{_escape(endpoint)}"}} {value_of(stats)}')
+
+            histogram('cms_request_duration_seconds', 'Request latency of sampled requests.', 'latency')
+            histogram('cms_request_queries', 'SQL queries per sampled request.', 'queries')
+            counter('cms_query_seconds_total', 'Time spent in SQL queries.', lambda s: s.query_seconds)
+            counter('cms_template_render_seconds_total', 'Time spent rendering templates.',
+                    lambda s: s.render_seconds)
+            counter('cms_n_plus_one_total', 'Requests repeating one statement at least '
+                    'METRICS_N_PLUS_ONE_THRESHOLD times.', lambda s: s.n_plus_one)
+        return '\n'.join(lines) + '\n'
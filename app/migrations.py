@@ -0,0 +1,277 @@
+"""Versioned schema migrations
+
+Each migration is applied once, in order, and the last applied version is
+recorded in the schema_version table. Migrations only add what is missing
+so a database created by any earlier release of the app can be upgraded
+in place; a new database is created from the models and stamped directly.
+"""
+from sqlalchemy import inspect, text
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a migration function taking (connection, inspector)"""
+    def decorator(f):
+        MIGRATIONS.append((version, description, f))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return f
+    return decorator
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def _add_column(connection, inspector, column):
+    table = column.table.name
+    if column.name in {c['name'] for c in inspector.get_columns(table)}:
+        return
+    column_type = column.type.compile(dialect=connection.dialect)
+    connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{column.name}" {column_type}'))
+
+
+def _create_table(connection, model):
+    model.__table__.create(connection, checkfirst=True)
+
+
+def _create_indexes(connection, model):
+    for index in model.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+@migration(1, 'Initial schema: user, page, media, theme')
+def initial_schema(connection, inspector):
+    from app.models import User, Page, Media, Theme
+    for model in (User, Media, Page, Theme):
+        _create_table(connection, model)
+
+
+@migration(2, 'Site version table')
+def site_state(connection, inspector):
+    from app.models import SiteState
+    _create_table(connection, SiteState)
+    _add_column(connection, inspect(connection), SiteState.__table__.c.menu_updated_at)
+
+
+@migration(3, 'Image dimensions and derivatives')
+def media_derivatives(connection, inspector):
+    from app.models import Media, MediaDerivative
+    _add_column(connection, inspector, Media.__table__.c.width)
+    _add_column(connection, inspector, Media.__table__.c.height)
+    _create_table(connection, MediaDerivative)
+
+
+@migration(4, 'Content-addressed blobs')
+def blobs(connection, inspector):
+    from app.models import Media, Blob
+    _create_table(connection, Blob)
+    _add_column(connection, inspector, Media.__table__.c.blob_sha256)
+
+
+@migration(5, 'Indexes for the public menu and the admin lists')
+def hot_path_indexes(connection, inspector):
+    from app.models import User, Page, Media, MediaDerivative
+    for model in (User, Page, Media, MediaDerivative):
+        _create_indexes(connection, model)
+
+
+@migration(6, 'Full-text search index of the pages')
+def page_search(connection, inspector):
+    from app.search import rebuild_search_index
+    rebuild_search_index(connection)
+
+
+@migration(7, 'Background job queue')
+def job_queue(connection, inspector):
+    from app.models import Job
+    _create_table(connection, Job)
+
+
+@migration(8, 'Media embedded in pages')
+def media_references(connection, inspector):
+    from app.models import Media, MediaDerivative, PageMedia
+    from app.references import rebuild_references
+    _create_table(connection, PageMedia)
+    for model in (Media, MediaDerivative):
+        _create_indexes(connection, model)
+    rebuild_references(connection)
+
+
+@migration(9, 'Dashboard counters')
+def site_stats(connection, inspector):
+    from app.models import SiteStats
+    from app.stats import reconcile
+    _create_table(connection, SiteStats)
+    reconcile(connection)
+
+
+@migration(10, 'Deleted pages for the API change feed')
+def page_tombstones(connection, inspector):
+    from app.models import PageTombstone
+    _create_table(connection, PageTombstone)
+
+
+@migration(11, 'Media references from legacy /static/uploads links')
+def legacy_media_references(connection, inspector):
+    from app.references import rebuild_references
+    rebuild_references(connection)
+
+
+@migration(12, 'Users version for the user caches of every worker')
+def users_version(connection, inspector):
+    from app.models import SiteState
+    _add_column(connection, inspector, SiteState.__table__.c.users_version)
+
+
+@migration(13, 'Time of the last site version bump, for Last-Modified')
+def site_updated_at(connection, inspector):
+    from app.models import SiteState
+    _add_column(connection, inspector, SiteState.__table__.c.updated_at)
+
+
+@migration(14, 'First publication of pages, drafts stay out of the API feed')
+def page_published_at(connection, inspector):
+    from sqlalchemy import func, update
+    from app.models import Page
+    _add_column(connection, inspector, Page.__table__.c.published_at)
+    # Earlier publications are unknown, the current ones are kept
+    connection.execute(update(Page)
+                       .where(Page.is_published.is_(True), Page.published_at.is_(None))
+                       .values(published_at=func.coalesce(Page.updated_at, Page.created_at)))
+
+
+def current_version(connection):
+    """Version recorded in the database, 0 for an empty one
+
+    A database created before migrations existed has the initial tables
+    but no schema_version table, it is considered at version 1.
+    """
+    tables = set(inspect(connection).get_table_names())
+    if 'schema_version' in tables:
+        version = connection.execute(text('SELECT version FROM schema_version WHERE id = 1')).scalar()
+        if version is not None:
+            return version
+    return 1 if 'page' in tables else 0
+
+
+def _stamp(connection, version):
+    from app.models import SchemaVersion
+    _create_table(connection, SchemaVersion)
+    updated = connection.execute(text('UPDATE schema_version SET version = :v WHERE id = 1'), {'v': version})
+    if not updated.rowcount:
+        connection.execute(text('INSERT INTO schema_version (id, version) VALUES (1, :v)'), {'v': version})
+
+
+def upgrade(log=None):
+    """Bring the database schema up to date, returns the applied versions"""
+    from app import db
+
+    applied = []
+    with db.engine.begin() as connection:
+        version = current_version(connection)
+        if version == 0:
+            db.metadata.create_all(connection)
+            # Tables outside the models
+            from app.search import create_search_table
+            create_search_table(connection)
+            _stamp(connection, latest_version())
+            return applied
+
+        for number, description, apply in MIGRATIONS:
+            if number <= version:
+                continue
+            if log:
+                log(f'Applying migration {number}: {description}')
+            apply(connection, inspect(connection))
+            _stamp(connection, number)
+            applied.append(number)
+    return applied
+
+
+# Query shapes on the request hot paths, checked by `flask db check-indexes`:
+# a query, or (query, index) when the plan must SEARCH that index
+def hot_queries():
+    from datetime import datetime
+    from app.models import User, Page, PageTombstone, Media, MediaDerivative, PageMedia, Job
+    from sqlalchemy import func, or_
+    from app.pagination import seek_before, seek_after
+
+    now = datetime.utcnow()
+    return {
+        'public menu': Page.query.with_entities(Page.id, Page.title, Page.slug, Page.menu_order, Page.updated_at)
+            .filter_by(show_in_menu=True, is_published=True).order_by(Page.menu_order),
+        'page by slug': Page.query.with_entities(Page.id, Page.updated_at)
+            .filter_by(slug='home', is_published=True),
+        'admin pages': Page.query.filter(Page.updated_at.isnot(None))
+            .order_by(Page.updated_at.desc(), Page.id.desc()).limit(51),
+        # Cursor pages must seek into the index, not walk it from the start
+        'admin pages (next)': (Page.query.filter(seek_before(Page.updated_at, Page.id, now, 1))
+                               .order_by(Page.updated_at.desc(), Page.id.desc()).limit(51),
+                               'ix_page_updated_at_id'),
+        'admin pages (previous)': (Page.query.filter(seek_after(Page.updated_at, Page.id, now, 1))
+                                   .order_by(Page.updated_at.asc(), Page.id.asc()).limit(51),
+                                   'ix_page_updated_at_id'),
+        # Rows without a timestamp, read once the dated ones are exhausted
+        'admin pages (no timestamp)': (Page.query.filter(seek_before(Page.updated_at, Page.id, None, 1))
+                                       .order_by(Page.updated_at.desc(), Page.id.desc()).limit(51),
+                                       'ix_page_updated_at_id'),
+        'api pages (no timestamp)': (Page.query.with_entities(Page.id, Page.updated_at, Page.is_published)
+                                     .filter(or_(Page.is_published.is_(True), Page.published_at.isnot(None)))
+                                     .filter(seek_after(Page.updated_at, Page.id, None, 1))
+                                     .order_by(Page.updated_at.asc(), Page.id.asc()).limit(51),
+                                     'ix_page_updated_at_id'),
+        'api pages (next)': (Page.query.with_entities(Page.id, Page.updated_at, Page.is_published)
+                             .filter(or_(Page.is_published.is_(True), Page.published_at.isnot(None)))
+                             .filter(seek_after(Page.updated_at, Page.id, now, 1))
+                             .order_by(Page.updated_at.asc(), Page.id.asc()).limit(51),
+                             'ix_page_updated_at_id'),
+        'api deleted pages (next)': (PageTombstone.query
+                                     .with_entities(PageTombstone.page_id, PageTombstone.deleted_at)
+                                     .filter(seek_after(PageTombstone.deleted_at, PageTombstone.page_id, now, 1))
+                                     .order_by(PageTombstone.deleted_at.asc(), PageTombstone.page_id.asc())
+                                     .limit(51),
+                                     'ix_page_tombstone_deleted_at_page_id'),
+        'admin media (next)': (Media.query.filter(seek_before(Media.uploaded_at, Media.id, now, 1))
+                               .order_by(Media.uploaded_at.desc(), Media.id.desc()).limit(51),
+                               'ix_media_uploaded_at_id'),
+        'admin users (next)': (User.query.filter(seek_before(User.created_at, User.id, now, 1))
+                               .order_by(User.created_at.desc(), User.id.desc()).limit(51),
+                               'ix_user_created_at_id'),
+        'admin media': Media.query.filter(Media.uploaded_at.isnot(None)).order_by(Media.uploaded_at.desc(), Media.id.desc()).limit(51),
+        'admin users': User.query.filter(User.created_at.isnot(None)).order_by(User.created_at.desc(), User.id.desc()).limit(51),
+        'media derivatives': MediaDerivative.query.filter(MediaDerivative.media_id.in_([1, 2, 3])),
+        'media by blob': Media.query.filter(Media.blob_sha256 == '0' * 64),
+        'job queue': Job.query.with_entities(Job.id).filter(Job.status == 'pending', Job.run_at <= now)
+            .order_by(Job.run_at, Job.id).limit(1),
+        'media usage': PageMedia.query.with_entities(PageMedia.media_id, func.count(PageMedia.page_id))
+            .filter(PageMedia.media_id.in_([1, 2, 3])).group_by(PageMedia.media_id),
+        'media by filename': Media.query.with_entities(Media.id).filter(Media.filename.in_(['a.jpg', 'b.jpg'])),
+        'derivatives by filename': MediaDerivative.query.with_entities(MediaDerivative.media_id)
+            .filter(MediaDerivative.filename.in_(['a.jpg', 'b.jpg'])),
+    }
+
+
+def explain(query):
+    """SQLite query plan lines of an ORM query"""
+    from app import db
+    compiled = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    params = tuple(
+        str(value) if not isinstance(value, (int, float, str, type(None))) else value
+        for value in (compiled.params[name] for name in compiled.positiontup)
+    )
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def is_seek(plan_line, index):
+    """Whether a plan line range-searches the given index"""
+    return plan_line.startswith('SEARCH') and f'INDEX {index} ' in plan_line + ' '
+
+
+def is_full_scan(plan_line):
+    """Whether a plan line reads a whole table or sorts in a temporary b-tree"""
+    if 'TEMP B-TREE' in plan_line:
+        return True
+    return plan_line.startswith('SCAN') and 'INDEX' not in plan_line
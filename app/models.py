@@ -5,6 +5,9 @@ from app import db
 
 class User(UserMixin, db.Model):
     """User model for authentication"""
+    __table_args__ = (
+        db.Index('ix_user_created_at_id', 'created_at', 'id'),  # admin list
+    )
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -24,6 +27,11 @@ class User(UserMixin, db.Model):
 
 class Page(db.Model):
     """Dynamic page model"""
+    __table_args__ = (
+        # Public menu: filter on both flags, ordered by menu_order
+        db.Index('ix_page_menu', 'is_published', 'show_in_menu', 'menu_order'),
+        db.Index('ix_page_updated_at_id', 'updated_at', 'id'),  # admin list
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     slug = db.Column(db.String(200), unique=True, nullable=False)
@@ -33,15 +41,25 @@ class Page(db.Model):
     menu_order = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    published_at = db.Column(db.DateTime, nullable=True)  # first publication, drafts are not in the API feed
     created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_by = db.relationship('User', backref='pages')
 
+    @property
+    def was_published(self):
+        """Whether API clients may have seen the page"""
+        return bool(self.is_published) or self.published_at is not None
+
     def __repr__(self):
         return f'<Page {self.title}>'
 
 
 class Media(db.Model):
     """Media files (images, logos) model"""
+    __table_args__ = (
+        db.Index('ix_media_uploaded_at_id', 'uploaded_at', 'id'),  # admin list
+        db.Index('ix_media_filename', 'filename'),  # URLs found in page content
+    )
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
@@ -50,14 +68,73 @@ class Media(db.Model):
     mime_type = db.Column(db.String(100), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
     alt_text = db.Column(db.String(255))
+    width = db.Column(db.Integer)  # filled in once derivatives are generated
+    height = db.Column(db.Integer)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     uploaded_by = db.relationship('User', backref='media_files')
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('blob.sha256'), nullable=True, index=True)
+    blob = db.relationship('Blob', backref='media_files')
 
     def __repr__(self):
         return f'<Media {self.original_filename}>'
 
 
+class Blob(db.Model):
+    """File content stored once under its SHA-256, shared by Media rows"""
+    sha256 = db.Column(db.String(64), primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)  # relative to UPLOAD_FOLDER
+    file_path = db.Column(db.String(500), nullable=False)
+    file_size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Blob {self.sha256[:12]} x{self.ref_count}>'
+
+
+class MediaDerivative(db.Model):
+    """Resized copy of an uploaded image (thumbnail, responsive width)"""
+    __table_args__ = (
+        db.Index('ix_media_derivative_filename', 'filename'),  # URLs found in page content
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    media_id = db.Column(db.Integer, db.ForeignKey('media.id'), nullable=False, index=True)
+    media = db.relationship('Media', backref=db.backref(
+        'derivatives', cascade='all, delete-orphan', order_by='MediaDerivative.width'))
+    name = db.Column(db.String(20), nullable=False)  # thumb, small, medium...
+    format = db.Column(db.String(10), nullable=False)  # webp, jpeg...
+    filename = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    file_size = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<MediaDerivative {self.filename}>'
+
+
+class PageMedia(db.Model):
+    """Media file embedded in the content of a page (see app.references)"""
+    __tablename__ = 'page_media'
+    __table_args__ = (
+        db.Index('ix_page_media_media_id', 'media_id', 'page_id'),  # usages of a media
+    )
+    page_id = db.Column(db.Integer, db.ForeignKey('page.id'), primary_key=True)
+    media_id = db.Column(db.Integer, db.ForeignKey('media.id'), primary_key=True)
+
+
+class PageTombstone(db.Model):
+    """Page deleted from the admin, reported as removed by the API change feed"""
+    __tablename__ = 'page_tombstone'
+    __table_args__ = (
+        db.Index('ix_page_tombstone_deleted_at_page_id', 'deleted_at', 'page_id'),  # API cursor
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    page_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
 class Theme(db.Model):
     """Theme customization settings"""
     id = db.Column(db.Integer, primary_key=True)
@@ -76,3 +153,64 @@ class Theme(db.Model):
 
     def __repr__(self):
         return f'<Theme {self.site_name}>'
+
+
+class SchemaVersion(db.Model):
+    """Single-row table recording the last migration applied"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+
+class SiteState(db.Model):
+    """Single-row table holding the public content version"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    menu_updated_at = db.Column(db.DateTime, nullable=True)  # last change of the public menu
+    updated_at = db.Column(db.DateTime, nullable=True)  # last version bump
+    users_version = db.Column(db.Integer, nullable=True)  # bumped by user writes (see app.users)
+
+    def __repr__(self):
+        return f'<SiteState v{self.version}>'
+
+
+class SiteStats(db.Model):
+    """Single-row table of content counters for the dashboard (see app.stats)"""
+    __tablename__ = 'site_stats'
+    id = db.Column(db.Integer, primary_key=True)
+    pages = db.Column(db.Integer, nullable=False, default=0)
+    published_pages = db.Column(db.Integer, nullable=False, default=0)
+    media = db.Column(db.Integer, nullable=False, default=0)
+    media_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    users = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def draft_pages(self):
+        return self.pages - self.published_pages
+
+    def __repr__(self):
+        return f'<SiteStats {self.pages} pages, {self.media} media, {self.users} users>'
+
+
+class Job(db.Model):
+    """Background job, persisted so it survives restarts (see app.jobs)"""
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at', 'id'),  # queue polling
+        db.Index('ix_job_created_at_id', 'created_at', 'id'),  # admin list
+    )
+    STATUSES = ('pending', 'running', 'done', 'failed')
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    duration_ms = db.Column(db.Float, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.name} {self.status}>'
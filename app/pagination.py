@@ -0,0 +1,165 @@
+"""Keyset (cursor) pagination for the admin list views
+
+Rows are ordered by (timestamp desc, id desc) and each page starts right
+after the last row of the previous one, so the database never scans the
+skipped rows (no OFFSET) and pages stay stable while rows are inserted.
+Rows without a timestamp sort first, as in SQLite: they are read with
+their own (column IS NULL, id) range when a page reaches them.
+"""
+import base64
+import json
+from datetime import datetime
+from flask import current_app, request, url_for
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(value, row_id):
+    """Opaque cursor pointing at a (timestamp, id) position"""
+    payload = json.dumps([value.isoformat() if value is not None else None, row_id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(timestamp or None, id) from a cursor, or None if missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return (datetime.fromisoformat(value) if value is not None else None), int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def seek_before(column, id_column, value, row_id):
+    """Rows sorted before (value, row_id) in (column, id) order
+
+    Written as column <= value AND (...) rather than a plain OR so the
+    database can range-scan the (column, id) index from the cursor. Rows
+    without a timestamp are left out unless value is None, see seek().
+    """
+    if value is None:
+        return and_(column.is_(None), id_column < row_id)
+    return and_(column <= value, or_(column < value, id_column < row_id))
+
+
+def seek_after(column, id_column, value, row_id):
+    """Rows sorted after (value, row_id) in (column, id) order, see seek_before()"""
+    if value is None:
+        return and_(column.is_(None), id_column > row_id)
+    return and_(column >= value, or_(column > value, id_column > row_id))
+
+
+def seek(query, column, id_column, cursor, limit, descending=True):
+    """Up to limit rows of query past a (timestamp, id) cursor, or from the start
+
+    Rows with and without a timestamp are read by separate range
+    conditions, the second only when the first does not fill the page.
+    """
+    value, row_id = cursor if cursor is not None else (None, None)
+    if descending:
+        order = (column.desc(), id_column.desc())
+        # Newest dated rows first, then the rows without a timestamp
+        if cursor is None:
+            ranges = [column.isnot(None), column.is_(None)]
+        elif value is not None:
+            ranges = [seek_before(column, id_column, value, row_id), column.is_(None)]
+        else:
+            ranges = [seek_before(column, id_column, None, row_id)]
+    else:
+        order = (column.asc(), id_column.asc())
+        # Rows without a timestamp first, then the oldest dated rows
+        if cursor is None:
+            ranges = [column.is_(None), column.isnot(None)]
+        elif value is None:
+            ranges = [seek_after(column, id_column, None, row_id), column.isnot(None)]
+        else:
+            ranges = [seek_after(column, id_column, value, row_id)]
+
+    rows = []
+    for condition in ranges:
+        if len(rows) >= limit:
+            break
+        rows += query.filter(condition).order_by(*order).limit(limit - len(rows)).all()
+    return rows
+
+
+def get_page_size():
+    """Requested page size, bounded by ADMIN_MAX_PAGE_SIZE"""
+    default = current_app.config.get('ADMIN_PAGE_SIZE', 50)
+    maximum = current_app.config.get('ADMIN_MAX_PAGE_SIZE', 200)
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, maximum))
+
+
+class KeysetPagination:
+    """One page of results plus the cursors to its neighbours"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, prefix=''):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.prefix = prefix
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def _url(self, **cursor):
+        # Keep the search/filter arguments, replace the cursor
+        args = {k: v for k, v in request.args.items()
+                if k not in (self.prefix + 'after', self.prefix + 'before')}
+        args.update({self.prefix + k: v for k, v in cursor.items()})
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    @property
+    def first_url(self):
+        return self._url()
+
+    @property
+    def next_url(self):
+        return self._url(after=self.next_cursor) if self.has_next else None
+
+    @property
+    def prev_url(self):
+        return self._url(before=self.prev_cursor) if self.has_prev else None
+
+
+def paginate_keyset(query, column, id_column, per_page=None, prefix=''):
+    """Fetch the page of query designated by the after/before request arguments
+
+    column is the timestamp the list is sorted on (newest first), id_column
+    breaks ties. prefix namespaces the arguments when a view pages
+    several lists.
+    """
+    per_page = per_page or get_page_size()
+    after = decode_cursor(request.args.get(prefix + 'after'))
+    before = decode_cursor(request.args.get(prefix + 'before'))
+
+    if before is not None:
+        rows = seek(query, column, id_column, before, per_page + 1, descending=False)
+        has_prev = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        has_next = True
+    else:
+        rows = seek(query, column, id_column, after, per_page + 1)
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        has_prev = after is not None
+
+    def cursor_of(row):
+        return encode_cursor(getattr(row, column.key), getattr(row, id_column.key))
+
+    return KeysetPagination(
+        rows,
+        per_page,
+        next_cursor=cursor_of(rows[-1]) if has_next and rows else None,
+        prev_cursor=cursor_of(rows[0]) if has_prev and rows else None,
+        prefix=prefix
+    )
@@ -0,0 +1,145 @@
+"""Media embedded in pages, recorded in the page_media table
+
+The content of a page is scanned for upload URLs (/media/<filename> or
+the older /static/uploads/<filename>, relative or absolute, originals
+and derivatives) when it is saved, and the media
+they point to are written to page_media in the same transaction. Usage
+counts and delete checks then read that table through its media_id
+index instead of searching the HTML of every page. `flask media
+backfill-references` rebuilds it from the page table.
+"""
+from urllib.parse import unquote
+from sqlalchemy import delete, func, insert, select, union
+from app.images import MEDIA_URL
+
+
+def referenced_filenames(html):
+    """Filenames (relative to UPLOAD_FOLDER) of the media URLs in some HTML"""
+    return {unquote(filename).rstrip('.') for _prefix, filename in MEDIA_URL.findall(html or '')}
+
+
+def media_ids(executor, filenames):
+    """Ids of the media whose original or a derivative has one of the filenames
+
+    executor is a session or a connection.
+    """
+    from app.models import Media, MediaDerivative
+    if not filenames:
+        return set()
+    filenames = list(filenames)
+    query = union(select(Media.id).where(Media.filename.in_(filenames)),
+                  select(MediaDerivative.media_id).where(MediaDerivative.filename.in_(filenames)))
+    return {media_id for (media_id,) in executor.execute(query)}
+
+
+def update_page_references(page):
+    """Record the media embedded in a flushed page, as part of the current transaction"""
+    from app import db
+    from app.models import PageMedia
+    db.session.execute(delete(PageMedia).where(PageMedia.page_id == page.id))
+    ids = media_ids(db.session, referenced_filenames(page.content))
+    if ids:
+        db.session.execute(insert(PageMedia), [{'page_id': page.id, 'media_id': media_id} for media_id in ids])
+
+
+def remove_page_references(page_ids):
+    """Forget the media embedded in deleted pages, in one statement"""
+    from app import db
+    from app.models import PageMedia
+    if page_ids:
+        db.session.execute(delete(PageMedia).where(PageMedia.page_id.in_(list(page_ids))))
+
+
+def remove_media_references(media_ids):
+    """Forget the pages embedding deleted media, in one statement"""
+    from app import db
+    from app.models import PageMedia
+    if media_ids:
+        db.session.execute(delete(PageMedia).where(PageMedia.media_id.in_(list(media_ids))))
+
+
+def usage_counts(ids):
+    """Number of pages embedding each media, by id (absent when unused)"""
+    from app import db
+    from app.models import PageMedia
+    if not ids:
+        return {}
+    rows = (db.session.query(PageMedia.media_id, func.count(PageMedia.page_id))
+            .filter(PageMedia.media_id.in_(list(ids)))
+            .group_by(PageMedia.media_id))
+    return dict(rows)
+
+
+def shared_media(ids):
+    """Ids among ids whose blob is also referenced by another media row"""
+    from app import db
+    from app.models import Media
+    if not ids:
+        return set()
+    shared_blobs = (select(Media.blob_sha256).where(Media.blob_sha256.isnot(None))
+                    .group_by(Media.blob_sha256).having(func.count(Media.id) > 1))
+    return {media_id for (media_id,) in db.session.query(Media.id)
+            .filter(Media.id.in_(list(ids)), Media.blob_sha256.in_(shared_blobs))}
+
+
+def blocking_usages(ids):
+    """Usage counts of the media among ids that cannot be deleted together
+
+    Media sharing a blob are served under the same URLs, so the pages
+    embedding it only hold back the deletion of its last rows: a media is
+    free to go while a row of its blob remains outside the selection.
+    """
+    from app import db
+    from app.models import Media
+    usages = usage_counts(ids)
+    blobs = dict(db.session.query(Media.id, Media.blob_sha256)
+                 .filter(Media.id.in_(list(usages)), Media.blob_sha256.isnot(None))) if usages else {}
+    if not blobs:
+        return usages
+    # Rows of the same blobs left after the deletion
+    kept = {sha256 for (sha256,) in db.session.query(Media.blob_sha256)
+            .filter(Media.blob_sha256.in_(set(blobs.values())), Media.id.notin_(list(ids)))
+            .distinct()}
+    return {media_id: count for media_id, count in usages.items() if blobs.get(media_id) not in kept}
+
+
+def rebuild_references(connection, batch_size=1000):
+    """Re-extract the references of every page, returns the number recorded"""
+    from app.models import Page, PageMedia
+    connection.execute(delete(PageMedia))
+    count = 0
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(Page.id, Page.content).where(Page.id > last_id).order_by(Page.id).limit(batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        filenames = {row.id: referenced_filenames(row.content) for row in rows}
+        # One lookup per batch, then matched back to each page
+        wanted = set().union(*filenames.values())
+        ids_by_filename = _ids_by_filename(connection, wanted)
+        references = [
+            {'page_id': page_id, 'media_id': media_id}
+            for page_id, names in filenames.items()
+            for media_id in {i for name in names for i in ids_by_filename.get(name, ())}
+        ]
+        if references:
+            connection.execute(insert(PageMedia), references)
+        count += len(references)
+        last_id = rows[-1].id
+    return count
+
+
+def _ids_by_filename(connection, filenames):
+    from app.models import Media, MediaDerivative
+    found = {}
+    if not filenames:
+        return found
+    filenames = list(filenames)
+    query = union(select(Media.filename, Media.id).where(Media.filename.in_(filenames)),
+                  select(MediaDerivative.filename, MediaDerivative.media_id)
+                  .where(MediaDerivative.filename.in_(filenames)))
+    for filename, media_id in connection.execute(query):
+        found.setdefault(filename, set()).add(media_id)
+    return found
@@ -1,12 +1,26 @@
+import hmac
+import mimetypes
 import os
+import zipfile
+from collections import Counter
 from datetime import datetime
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, send_from_directory
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, send_from_directory, abort, Response
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
+from sqlalchemy import or_, case, delete, func, insert, update
+from sqlalchemy.orm import defer, selectinload
 from functools import wraps
-from app import db
-from app.models import Page, Media, Theme, User
-from app.forms import PageForm, MediaUploadForm, ThemeForm, UserForm
+from app import db, page_cache, site_context, metrics, sitemaps, stats
+from app.models import Page, PageTombstone, Media, MediaDerivative, Theme, User, Job
+from app.forms import PageForm, MediaUploadForm, MediaBulkUploadForm, ThemeForm, UserForm
+from app.site import bump_site_version
+from app.images import schedule_derivatives
+from app.storage import store_upload, store_uploads, release_blob, release_blobs
+from app.jobs import enqueue
+from app.pagination import paginate_keyset
+from app.search import index_page, remove_page, remove_pages, matching_page_ids, is_supported as search_supported
+from app.references import (update_page_references, remove_page_references, remove_media_references,
+                            usage_counts, shared_media, blocking_usages)
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -20,30 +34,143 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def _menu_entry(page):
+    """What the public navigation menu shows for a page (None if absent)"""
+    if page.is_published and page.show_in_menu:
+        return (page.title, page.slug, page.menu_order)
+    return None
+
+def _invalidate_page(page, slug, menu_entry_before):
+    """Drop cached renderings affected by a committed page write"""
+    menu_entry_after = _menu_entry(page) if page is not None else None
+    if menu_entry_before != menu_entry_after:
+        # The menu is rendered into every public page
+        page_cache.clear()
+    else:
+        page_cache.invalidate_page(slug)
+        if page is not None and page.slug != slug:
+            page_cache.invalidate_page(page.slug)
+    site_context.expire()
+    sitemaps.invalidate()
+
+def _invalidate_pages(slugs, menu_changed):
+    """Drop cached renderings affected by a committed batch of page writes"""
+    if menu_changed:
+        page_cache.clear()
+    else:
+        for slug in slugs:
+            page_cache.invalidate_page(slug)
+    site_context.expire()
+    sitemaps.invalidate()
+
+def _invalidate_site():
+    """Drop every cached rendering after a committed theme write"""
+    page_cache.clear()
+    site_context.expire()
+    # The feed carries the site name
+    sitemaps.invalidate()
+
 @bp.route('/')
 @login_required
 @admin_required
 def dashboard():
-    """Admin dashboard"""
-    pages_count = Page.query.count()
-    media_count = Media.query.count()
-    users_count = User.query.count()
-    recent_pages = Page.query.order_by(Page.updated_at.desc()).limit(5).all()
-
-    return render_template('admin/dashboard.html',
-                         pages_count=pages_count,
-                         media_count=media_count,
-                         users_count=users_count,
-                         recent_pages=recent_pages)
+    """Admin dashboard: maintained counters and the last edited pages"""
+    recent_pages = (Page.query
+                    .with_entities(Page.id, Page.title, Page.slug, Page.is_published, Page.updated_at)
+                    .order_by(Page.updated_at.desc(), Page.id.desc())
+                    .limit(5)
+                    .all())
+    return render_template('admin/dashboard.html', stats=stats.read_stats(), recent_pages=recent_pages)
 
 # Page Management
 @bp.route('/pages')
 @login_required
 @admin_required
 def pages():
-    """List all pages"""
-    all_pages = Page.query.order_by(Page.updated_at.desc()).all()
-    return render_template('admin/pages/list.html', pages=all_pages)
+    """List pages, newest first, with search and filters"""
+    query = Page.query.options(defer(Page.content))
+    search = request.args.get('q', '').strip()
+    if search and search_supported(db.engine):
+        query = query.filter(Page.id.in_(matching_page_ids(search)))
+    elif search:
+        query = query.filter(or_(Page.title.ilike(f'%{search}%'), Page.slug.ilike(f'%{search}%')))
+    status = request.args.get('status')
+    if status in ('published', 'draft'):
+        query = query.filter(Page.is_published == (status == 'published'))
+    menu = request.args.get('menu')
+    if menu in ('yes', 'no'):
+        query = query.filter(Page.show_in_menu == (menu == 'yes'))
+
+    pagination = paginate_keyset(query, Page.updated_at, Page.id)
+    return render_template('admin/pages/list.html', pages=pagination.items, pagination=pagination)
+
+def _selected_ids():
+    """Ids of the rows ticked in a batch form"""
+    return sorted({int(value) for value in request.form.getlist('ids') if value.isdigit()})
+
+def _menu_entries(ids):
+    """Menu entry of each page, by id, read in one query"""
+    rows = db.session.query(Page.id, Page.title, Page.slug, Page.menu_order,
+                            Page.is_published, Page.published_at, Page.show_in_menu).filter(Page.id.in_(ids))
+    return {row.id: (row, _menu_entry(row)) for row in rows}
+
+@bp.route('/pages/batch', methods=['POST'])
+@login_required
+@admin_required
+def pages_batch():
+    """Publish, unpublish, delete or reorder several pages with set-based statements"""
+    action = request.form.get('action')
+    if action == 'reorder':
+        # Every listed row sends its order, ticked or not
+        orders = {int(key[6:]): request.form.get(key, type=int)
+                  for key in request.form if key.startswith('order_') and key[6:].isdigit()}
+        orders = {page_id: order for page_id, order in orders.items() if order is not None}
+        ids = sorted(orders)
+    else:
+        ids = _selected_ids()
+    if action not in ('publish', 'unpublish', 'delete', 'reorder') or not ids:
+        flash('Sélectionnez au moins une page et une action.', 'warning')
+        return redirect(url_for('admin.pages'))
+
+    before = _menu_entries(ids)
+    ids = sorted(before)
+    if action == 'delete':
+        remove_page_references(ids)
+        db.session.execute(delete(Page).where(Page.id.in_(ids)), execution_options={'synchronize_session': False})
+        # Drafts never published were never seen by the API clients
+        seen = [page_id for page_id, (row, _entry) in before.items() if row.is_published or row.published_at]
+        if seen:
+            db.session.execute(insert(PageTombstone), [{'page_id': page_id} for page_id in seen])
+        remove_pages(ids)
+    elif action == 'reorder':
+        db.session.execute(update(Page)
+                           .where(Page.id.in_(ids))
+                           .values(menu_order=case({i: orders[i] for i in ids}, value=Page.id)),
+                           execution_options={'synchronize_session': False})
+    else:
+        now = datetime.utcnow()
+        published = action == 'publish'
+        # Keep the first publication; unpublished pages record theirs if it predates the column
+        first_published = func.coalesce(Page.published_at,
+                                        now if published else case((Page.is_published.is_(True), now)))
+        db.session.execute(update(Page)
+                           .where(Page.id.in_(ids))
+                           .values(is_published=published, published_at=first_published, updated_at=now),
+                           execution_options={'synchronize_session': False})
+
+    after = _menu_entries(ids)
+    # Set-based statements bypass the flush that keeps the counters
+    stats.adjust(db.session, pages=len(after) - len(before),
+                 published_pages=sum(bool(row.is_published) for row, _entry in after.values())
+                 - sum(bool(row.is_published) for row, _entry in before.values()))
+    menu_changed = any(entry != after.get(page_id, (None, None))[1] for page_id, (_row, entry) in before.items())
+    bump_site_version(menu_changed=menu_changed)
+    db.session.commit()
+    _invalidate_pages([row.slug for row, _entry in before.values()], menu_changed)
+
+    labels = {'publish': 'publiée(s)', 'unpublish': 'dépubliée(s)', 'delete': 'supprimée(s)', 'reorder': 'réordonnée(s)'}
+    flash(f'{len(ids)} page(s) {labels[action]}.', 'success')
+    return redirect(url_for('admin.pages'))
 
 @bp.route('/pages/new', methods=['GET', 'POST'])
 @login_required
@@ -57,12 +184,18 @@ def page_new():
             slug=form.slug.data,
             content=form.content.data,
             is_published=form.is_published.data,
+            published_at=datetime.utcnow() if form.is_published.data else None,
             show_in_menu=form.show_in_menu.data,
             menu_order=form.menu_order.data,
-            created_by=current_user
+            created_by_id=current_user.id
         )
         db.session.add(page)
+        db.session.flush()
+        index_page(page)
+        update_page_references(page)
+        bump_site_version(menu_changed=_menu_entry(page) is not None)
         db.session.commit()
+        _invalidate_page(page, page.slug, None)
         flash(f'Page "{page.title}" créée avec succès!', 'success')
         return redirect(url_for('admin.pages'))
 
@@ -77,14 +210,21 @@ def page_edit(id):
     form = PageForm(obj=page)
 
     if form.validate_on_submit():
+        old_slug, old_menu_entry = page.slug, _menu_entry(page)
         page.title = form.title.data
         page.slug = form.slug.data
         page.content = form.content.data
+        if page.was_published or form.is_published.data:
+            page.published_at = page.published_at or datetime.utcnow()
         page.is_published = form.is_published.data
         page.show_in_menu = form.show_in_menu.data
         page.menu_order = form.menu_order.data
         page.updated_at = datetime.utcnow()
+        index_page(page)
+        update_page_references(page)
+        bump_site_version(menu_changed=_menu_entry(page) != old_menu_entry)
         db.session.commit()
+        _invalidate_page(page, old_slug, old_menu_entry)
         flash(f'Page "{page.title}" mise à jour avec succès!', 'success')
         return redirect(url_for('admin.pages'))
 
@@ -96,9 +236,15 @@ def page_edit(id):
 def page_delete(id):
     """Delete page"""
     page = Page.query.get_or_404(id)
-    title = page.title
+    title, slug, menu_entry = page.title, page.slug, _menu_entry(page)
+    remove_page_references([id])
     db.session.delete(page)
+    if page.was_published:
+        db.session.add(PageTombstone(page_id=id))
+    remove_page(id)
+    bump_site_version(menu_changed=menu_entry is not None)
     db.session.commit()
+    _invalidate_page(None, slug, menu_entry)
     flash(f'Page "{title}" supprimée avec succès!', 'success')
     return redirect(url_for('admin.pages'))
 
@@ -107,9 +253,28 @@ def page_delete(id):
 @login_required
 @admin_required
 def media():
-    """List all media files"""
-    all_media = Media.query.order_by(Media.uploaded_at.desc()).all()
-    return render_template('admin/media/list.html', media_files=all_media)
+    """List media files, newest first, with search and filters"""
+    query = Media.query.options(selectinload(Media.derivatives))
+    search = request.args.get('q', '').strip()
+    if search:
+        query = query.filter(or_(Media.original_filename.ilike(f'%{search}%'), Media.alt_text.ilike(f'%{search}%')))
+    file_type = request.args.get('type')
+    if file_type:
+        query = query.filter(Media.file_type == file_type)
+
+    pagination = paginate_keyset(query, Media.uploaded_at, Media.id)
+    ids = [m.id for m in pagination.items]
+    return render_template('admin/media/list.html', media_files=pagination.items, pagination=pagination,
+                           usages=usage_counts(ids), shared=shared_media(ids), theme_media=_theme_media())
+
+def _theme_media():
+    """Ids of the media used as the theme logo or favicon"""
+    theme = Theme.query.first()
+    return {theme.logo_id, theme.favicon_id} - {None} if theme else set()
+
+def _media_in_use(ids):
+    """Pages embedding each of the media (when deleting them would break those), and the set used by the theme"""
+    return blocking_usages(ids), _theme_media() & set(ids)
 
 @bp.route('/media/upload', methods=['GET', 'POST'])
 @login_required
@@ -121,35 +286,108 @@ def media_upload():
         file = form.file.data
         filename = secure_filename(file.filename)
 
-        # Generate unique filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{name}_{timestamp}{ext}"
-
-        # Save file
+        # Stream file into the content-addressed store (deduplicated)
         upload_folder = current_app.config['UPLOAD_FOLDER']
-        os.makedirs(upload_folder, exist_ok=True)
-        file_path = os.path.join(upload_folder, unique_filename)
-        file.save(file_path)
+        blob = store_upload(file.stream, upload_folder, os.path.splitext(filename)[1])
 
         # Create media record
         media = Media(
-            filename=unique_filename,
+            filename=blob.filename,
             original_filename=filename,
-            file_path=file_path,
+            file_path=blob.file_path,
             file_type=form.file_type.data,
             mime_type=file.content_type,
-            file_size=os.path.getsize(file_path),
+            file_size=blob.file_size,
             alt_text=form.alt_text.data,
-            uploaded_by=current_user
+            uploaded_by_id=current_user.id,
+            blob=blob
         )
         db.session.add(media)
+        db.session.flush()
+        # Resized versions are made by the job queue once committed
+        schedule_derivatives(media)
         db.session.commit()
         flash(f'Fichier "{filename}" téléchargé avec succès!', 'success')
         return redirect(url_for('admin.media'))
 
     return render_template('admin/media/upload.html', form=form)
 
+def _bulk_sources(files, archives):
+    """(original filename, mime type, (open_stream, ext)) of each image of a bulk upload
+
+    Zip archives are expanded, their images being read straight from the
+    archive; opened archives are appended to `archives` for the caller to
+    close. Returns the sources and the number of entries skipped.
+    """
+    allowed = current_app.config['ALLOWED_EXTENSIONS']
+    max_size = current_app.config['MEDIA_ZIP_MAX_SIZE']
+    sources, skipped = [], 0
+    for file in files:
+        filename = secure_filename(file.filename)
+        ext = os.path.splitext(filename)[1].lower()
+        if ext != '.zip':
+            sources.append((filename, file.content_type, (lambda stream=file.stream: stream, ext)))
+            continue
+
+        archive = zipfile.ZipFile(file.stream)
+        archives.append(archive)
+        entries = [info for info in archive.infolist() if not info.is_dir()]
+        if sum(info.file_size for info in entries) > max_size:
+            raise ValueError(f'L\'archive "{filename}" dépasse la taille décompressée autorisée.')
+        for info in entries:
+            name = secure_filename(os.path.basename(info.filename))
+            ext = os.path.splitext(name)[1].lower()
+            if not name or ext[1:] not in allowed or info.filename.startswith('__MACOSX/'):
+                skipped += 1
+                continue
+            sources.append((name, mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                            (lambda archive=archive, info=info: archive.open(info), ext)))
+    return sources, skipped
+
+@bp.route('/media/upload/bulk', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def media_bulk_upload():
+    """Upload several files or zip archives, recorded in a single transaction"""
+    form = MediaBulkUploadForm()
+    if form.validate_on_submit():
+        archives = []
+        try:
+            sources, skipped = _bulk_sources(form.files.data, archives)
+            blobs = store_uploads([source for _name, _mime_type, source in sources],
+                                  current_app.config['UPLOAD_FOLDER'],
+                                  current_app.config['MEDIA_UPLOAD_WORKERS'])
+        except (zipfile.BadZipFile, ValueError) as e:
+            db.session.rollback()
+            flash(f'Téléchargement impossible : {e}', 'danger')
+            return render_template('admin/media/bulk_upload.html', form=form)
+        finally:
+            for archive in archives:
+                archive.close()
+
+        media_files = [
+            Media(filename=blob.filename,
+                  original_filename=filename,
+                  file_path=blob.file_path,
+                  file_type=form.file_type.data,
+                  mime_type=mime_type,
+                  file_size=blob.file_size,
+                  uploaded_by_id=current_user.id,
+                  blob=blob)
+            for (filename, mime_type, _source), blob in zip(sources, blobs)
+        ]
+        db.session.add_all(media_files)
+        db.session.flush()
+        for media in media_files:
+            schedule_derivatives(media)
+        db.session.commit()
+        flash(f'{len(media_files)} fichier(s) téléchargé(s) avec succès!', 'success')
+        if skipped:
+            flash(f'{skipped} fichier(s) ignoré(s) dans les archives (format non accepté).', 'warning')
+        return redirect(url_for('admin.media'))
+
+    return render_template('admin/media/bulk_upload.html', form=form)
+
 @bp.route('/media/<int:id>/delete', methods=['POST'])
 @login_required
 @admin_required
@@ -157,19 +395,65 @@ def media_delete(id):
     """Delete media file"""
     media = Media.query.get_or_404(id)
     filename = media.original_filename
+    usages, theme_media = _media_in_use([id])
+    if usages or theme_media:
+        reasons = [f'utilisé par {usages[id]} page(s)'] if usages else []
+        reasons += ['utilisé par le thème'] if theme_media else []
+        flash(f'Le fichier "{filename}" ne peut pas être supprimé : {", ".join(reasons)}.', 'danger')
+        return redirect(url_for('admin.media'))
+    paths = [media.file_path] + [d.file_path for d in media.derivatives]
 
-    # Delete file from filesystem
-    try:
-        if os.path.exists(media.file_path):
-            os.remove(media.file_path)
-    except Exception as e:
-        flash(f'Erreur lors de la suppression du fichier: {e}', 'danger')
-
+    # Shared content is only removed with its last reference
+    last_reference = media.blob is None or release_blob(media.blob)
+    remove_media_references([id])
     db.session.delete(media)
+    if last_reference:
+        # File and derivatives are removed from disk by the job queue
+        enqueue('files.delete', paths=paths)
     db.session.commit()
+
     flash(f'Fichier "{filename}" supprimé avec succès!', 'success')
     return redirect(url_for('admin.media'))
 
+@bp.route('/media/batch', methods=['POST'])
+@login_required
+@admin_required
+def media_batch():
+    """Delete several media files with set-based statements, skipping those in use"""
+    ids = _selected_ids()
+    if request.form.get('action') != 'delete' or not ids:
+        flash('Sélectionnez au moins un fichier.', 'warning')
+        return redirect(url_for('admin.media'))
+
+    usages, theme_media = _media_in_use(ids)
+    in_use = set(usages) | theme_media
+    rows = db.session.query(Media.id, Media.file_path, Media.file_size, Media.blob_sha256) \
+        .filter(Media.id.in_(ids), Media.id.notin_(in_use)).all()
+    ids = [row.id for row in rows]
+    derivatives = db.session.query(MediaDerivative.media_id, MediaDerivative.file_path) \
+        .filter(MediaDerivative.media_id.in_(ids)).all()
+
+    db.session.execute(delete(MediaDerivative).where(MediaDerivative.media_id.in_(ids)),
+                       execution_options={'synchronize_session': False})
+    remove_media_references(ids)
+    db.session.execute(delete(Media).where(Media.id.in_(ids)),
+                       execution_options={'synchronize_session': False})
+    # Shared content is only removed with its last reference
+    released = release_blobs(Counter(row.blob_sha256 for row in rows if row.blob_sha256))
+    removed = {row.id for row in rows if row.blob_sha256 is None or row.blob_sha256 in released}
+    paths = [row.file_path for row in rows if row.id in removed] + \
+            [d.file_path for d in derivatives if d.media_id in removed]
+    if paths:
+        enqueue('files.delete', paths=sorted(set(paths)))
+    stats.adjust(db.session, media=-len(rows), media_bytes=-sum(row.file_size or 0 for row in rows))
+    db.session.commit()
+
+    if ids:
+        flash(f'{len(ids)} fichier(s) supprimé(s) avec succès!', 'success')
+    if in_use:
+        flash(f'{len(in_use)} fichier(s) conservé(s) car utilisé(s) par des pages ou le thème.', 'warning')
+    return redirect(url_for('admin.media'))
+
 # Theme Management
 @bp.route('/theme', methods=['GET', 'POST'])
 @login_required
@@ -193,13 +477,21 @@ def theme():
         theme.text_color = form.text_color.data
         theme.footer_text = form.footer_text.data
         theme.updated_at = datetime.utcnow()
+        bump_site_version()
         db.session.commit()
+        _invalidate_site()
         flash('Thème mis à jour avec succès!', 'success')
         return redirect(url_for('admin.theme'))
 
-    # Get all media for logo selection
-    all_media = Media.query.all()
-    return render_template('admin/theme.html', form=form, theme=theme, all_media=all_media)
+    # Media for logo/favicon selection, paged separately from the form
+    query = Media.query.options(selectinload(Media.derivatives))
+    search = request.args.get('media_q', '').strip()
+    if search:
+        query = query.filter(Media.original_filename.ilike(f'%{search}%'))
+    pagination = paginate_keyset(query, Media.uploaded_at, Media.id,
+                                 per_page=current_app.config.get('ADMIN_PAGE_SIZE', 50), prefix='media_')
+    return render_template('admin/theme.html', form=form, theme=theme,
+                           all_media=pagination.items, media_pagination=pagination)
 
 @bp.route('/theme/logo/<int:media_id>', methods=['POST'])
 @login_required
@@ -213,7 +505,9 @@ def theme_set_logo(media_id):
 
     media = Media.query.get_or_404(media_id)
     theme.logo_id = media_id
+    bump_site_version()
     db.session.commit()
+    _invalidate_site()
     flash('Logo mis à jour avec succès!', 'success')
     return redirect(url_for('admin.theme'))
 
@@ -229,7 +523,9 @@ def theme_set_favicon(media_id):
 
     media = Media.query.get_or_404(media_id)
     theme.favicon_id = media_id
+    bump_site_version()
     db.session.commit()
+    _invalidate_site()
     flash('Favicon mis à jour avec succès!', 'success')
     return redirect(url_for('admin.theme'))
 
@@ -238,9 +534,17 @@ def theme_set_favicon(media_id):
 @login_required
 @admin_required
 def users():
-    """List all users"""
-    all_users = User.query.order_by(User.created_at.desc()).all()
-    return render_template('admin/users/list.html', users=all_users)
+    """List users, newest first, with search and filters"""
+    query = User.query
+    search = request.args.get('q', '').strip()
+    if search:
+        query = query.filter(or_(User.username.ilike(f'%{search}%'), User.email.ilike(f'%{search}%')))
+    role = request.args.get('role')
+    if role in ('admin', 'user'):
+        query = query.filter(User.is_admin == (role == 'admin'))
+
+    pagination = paginate_keyset(query, User.created_at, User.id)
+    return render_template('admin/users/list.html', users=pagination.items, pagination=pagination)
 
 @bp.route('/users/new', methods=['GET', 'POST'])
 @login_required
@@ -277,3 +581,55 @@ def user_delete(id):
     db.session.commit()
     flash(f'Utilisateur "{username}" supprimé avec succès!', 'success')
     return redirect(url_for('admin.users'))
+
+# Background jobs
+@bp.route('/jobs')
+@login_required
+@admin_required
+def jobs():
+    """Job queue health: counts, backlog age, durations and recent jobs"""
+    counts = dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status))
+    oldest_pending = db.session.query(func.min(Job.run_at)).filter(
+        Job.status == 'pending', Job.run_at <= datetime.utcnow()).scalar()
+    durations = (db.session.query(Job.name, func.count(Job.id), func.avg(Job.duration_ms), func.max(Job.duration_ms))
+                 .filter(Job.status == 'done')
+                 .group_by(Job.name)
+                 .order_by(Job.name)
+                 .all())
+
+    query = Job.query
+    status = request.args.get('status')
+    if status in Job.STATUSES:
+        query = query.filter(Job.status == status)
+    pagination = paginate_keyset(query, Job.created_at, Job.id)
+    return render_template('admin/jobs.html', jobs=pagination.items, pagination=pagination,
+                           counts=counts, oldest_pending=oldest_pending, durations=durations,
+                           now=datetime.utcnow())
+
+@bp.route('/jobs/<int:id>/retry', methods=['POST'])
+@login_required
+@admin_required
+def job_retry(id):
+    """Put a failed job back in the queue"""
+    job = Job.query.get_or_404(id)
+    if job.status != 'failed':
+        flash('Seules les tâches en échec peuvent être relancées.', 'warning')
+        return redirect(url_for('admin.jobs'))
+    job.status = 'pending'
+    job.attempts = 0
+    job.run_at = datetime.utcnow()
+    db.session.info['jobs_enqueued'] = True
+    db.session.commit()
+    flash(f'Tâche #{job.id} relancée.', 'success')
+    return redirect(url_for('admin.jobs', status='pending'))
+
+# Monitoring
+@bp.route('/metrics')
+def metrics_view():
+    """Prometheus metrics, for admins or scrapers holding METRICS_TOKEN"""
+    token = current_app.config.get('METRICS_TOKEN')
+    authorization = request.headers.get('Authorization', '')
+    if not (token and hmac.compare_digest(authorization, f'Bearer {token}')):
+        if not current_user.is_authenticated or not current_user.is_admin:
+            abort(403)
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,224 @@
+"""Read-only JSON API over the published content, for headless clients
+
+Pages are listed oldest change first with a cursor, so a client syncs
+incrementally by following `next` until it is null and keeping the last
+cursor (or the `since` timestamp) for its next run. Pages unpublished or
+deleted since then come in the same list as {"id": ..., "removed": true}
+items, so the client can drop its copy; drafts that were never published
+are left out. Every response
+carries an ETag computed before the content is loaded, so unchanged
+resources cost a 304 and a couple of index lookups.
+"""
+from datetime import datetime, timezone
+from flask import Blueprint, current_app, jsonify, request, url_for
+from werkzeug.exceptions import BadRequest, HTTPException
+from sqlalchemy import or_
+from app import site_context
+from app.database import read_replica
+from app.http_cache import make_etag, latest, set_validators, not_modified
+from app.images import media_url
+from app.models import Page, PageTombstone
+from app.pagination import encode_cursor, decode_cursor, seek
+
+bp = Blueprint('api', __name__, url_prefix='/api')
+
+PAGE_FIELDS = ('id', 'slug', 'title', 'content', 'menu_order', 'show_in_menu', 'created_at', 'updated_at', 'url')
+# Lists leave out the content unless asked for
+LIST_FIELDS = ('id', 'slug', 'title', 'updated_at', 'url')
+
+@bp.errorhandler(HTTPException)
+def json_error(e):
+    return jsonify(error=e.name, message=e.description), e.code
+
+def _timestamp(value):
+    """ISO 8601 UTC timestamp of a naive UTC datetime"""
+    return value.isoformat(timespec='microseconds') + 'Z' if value else None
+
+def _parse_timestamp(value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise BadRequest(f'Invalid timestamp: {value!r}')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _requested_fields(default):
+    """Fields named by ?fields=, the default ones otherwise"""
+    value = request.args.get('fields')
+    if not value:
+        return default
+    fields = tuple(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in PAGE_FIELDS]
+    if unknown:
+        raise BadRequest(f'Unknown field(s): {", ".join(unknown)}')
+    return fields
+
+def _list_argument(name):
+    values = [v.strip() for v in request.args.get(name, '').split(',') if v.strip()]
+    if len(values) > current_app.config['API_MAX_BATCH']:
+        raise BadRequest(f'At most {current_app.config["API_MAX_BATCH"]} values for {name}')
+    return values
+
+def _load_pages(ids, fields):
+    """Published pages with only the selected columns, by id"""
+    columns = {f for f in fields if f != 'url'} | {'id', 'slug'}
+    rows = (Page.query
+            .with_entities(*(getattr(Page, c) for c in sorted(columns)))
+            .filter(Page.id.in_(ids))
+            .all())
+    return {row.id: _serialize(row, fields) for row in rows}
+
+def _serialize(row, fields):
+    data = {}
+    for field in fields:
+        if field == 'url':
+            data['url'] = url_for('main.page', slug=row.slug, _external=True)
+        elif field in ('created_at', 'updated_at'):
+            data[field] = _timestamp(getattr(row, field))
+        else:
+            data[field] = getattr(row, field)
+    return data
+
+def _conditional(etag, last_modified, build):
+    """304 when the client copy is fresh, else the JSON built by build()"""
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    response = jsonify(build())
+    return set_validators(response, etag, last_modified)
+
+@bp.route('/pages')
+@read_replica
+def pages():
+    """Published pages: batched lookup (?slug=a,b or ?id=1,2) or incremental list with removals"""
+    fields = _requested_fields(LIST_FIELDS)
+    slugs, ids = _list_argument('slug'), _list_argument('id')
+    if slugs or ids:
+        return _batch(fields, slugs, ids)
+
+    per_page = max(1, min(request.args.get('per_page', current_app.config['API_PAGE_SIZE'], type=int),
+                          current_app.config['API_MAX_PAGE_SIZE']))
+    # Pages unpublished after a publication are walked too (reported as
+    # removed), so both lists are read by seeking into their (timestamp, id) index
+    pages = (Page.query.with_entities(Page.id, Page.updated_at, Page.is_published)
+             .filter(or_(Page.is_published.is_(True), Page.published_at.isnot(None))))
+    deleted = PageTombstone.query.with_entities(PageTombstone.page_id, PageTombstone.deleted_at)
+    if request.args.get('since'):
+        since = _parse_timestamp(request.args['since'])
+        pages = pages.filter(Page.updated_at > since)
+        deleted = deleted.filter(PageTombstone.deleted_at > since)
+    after = None
+    if request.args.get('after'):
+        after = decode_cursor(request.args['after'])
+        if after is None:
+            raise BadRequest('Invalid cursor')
+    pages = seek(pages, Page.updated_at, Page.id, after, per_page + 1, descending=False)
+    deleted = seek(deleted, PageTombstone.deleted_at, PageTombstone.page_id, after, per_page + 1, descending=False)
+    # (timestamp, id, published) of both lists, merged in cursor order (no timestamp first)
+    keys = sorted([(p.updated_at, p.id, bool(p.is_published)) for p in pages] +
+                  [(d.deleted_at, d.page_id, False) for d in deleted],
+                  key=lambda key: (key[0] is not None, key[0] or datetime.min, key[1]))
+    has_next, keys = len(keys) > per_page, keys[:per_page]
+    cursor = encode_cursor(*keys[-1][:2]) if keys else request.args.get('after')
+
+    etag = make_etag('pages', fields, cursor, has_next,
+                     *(f'{row_id}:{updated_at}:{published}' for updated_at, row_id, published in keys))
+    last_modified = latest(*(updated_at for updated_at, _row_id, _published in keys))
+
+    def build():
+        loaded = _load_pages([row_id for _updated_at, row_id, published in keys if published], fields)
+        args = {k: v for k, v in request.args.items() if k != 'after'}
+        return {
+            'items': [loaded[row_id] if published else
+                      {'id': row_id, 'removed': True, 'updated_at': _timestamp(updated_at)}
+                      for updated_at, row_id, published in keys if not published or row_id in loaded],
+            'cursor': cursor,
+            'next': url_for('api.pages', after=cursor, _external=True, **args) if has_next else None,
+        }
+    return _conditional(etag, last_modified, build)
+
+def _batch(fields, slugs, ids):
+    """Pages asked by slug and/or id in one call, in the requested order"""
+    int_ids = []
+    for value in ids:
+        if not value.isdigit():
+            raise BadRequest(f'Invalid id: {value!r}')
+        int_ids.append(int(value))
+    keys = (Page.query
+            .with_entities(Page.id, Page.slug, Page.updated_at)
+            .filter(Page.is_published.is_(True), or_(Page.slug.in_(slugs), Page.id.in_(int_ids)))
+            .all())
+    by_slug = {k.slug: k for k in keys}
+    by_id = {k.id: k for k in keys}
+    requested = [('slug', s, by_slug.get(s)) for s in slugs] + [('id', i, by_id.get(i)) for i in int_ids]
+
+    etag = make_etag('batch', fields, *(f'{kind}={value}:{k.id if k else ""}:{k.updated_at if k else ""}'
+                                        for kind, value, k in requested))
+    last_modified = latest(*(k.updated_at for k in keys))
+
+    def build():
+        loaded = _load_pages([k.id for k in keys], fields)
+        items, missing, seen = [], [], set()
+        for kind, value, key in requested:
+            if key is None or key.id not in loaded:
+                missing.append({kind: value})
+            elif key.id not in seen:
+                seen.add(key.id)
+                items.append(loaded[key.id])
+        return {'items': items, 'missing': missing}
+    return _conditional(etag, last_modified, build)
+
+@bp.route('/pages/<slug>')
+@read_replica
+def page(slug):
+    """One published page, every field unless ?fields= says otherwise"""
+    fields = _requested_fields(PAGE_FIELDS)
+    key = (Page.query
+           .with_entities(Page.id, Page.updated_at)
+           .filter_by(slug=slug, is_published=True)
+           .first_or_404())
+    etag = make_etag('page', fields, key.id, key.updated_at)
+    return _conditional(etag, key.updated_at, lambda: _load_pages([key.id], fields)[key.id])
+
+@bp.route('/menu')
+@read_replica
+def menu():
+    """Navigation menu, in display order"""
+    site = site_context.get()
+
+    def build():
+        return {'items': [
+            {'id': item.id, 'title': item.title, 'slug': item.slug, 'menu_order': item.menu_order,
+             'url': url_for('main.page', slug=item.slug, _external=True)}
+            for item in site.menu_pages
+        ]}
+    return _conditional(make_etag('menu', site.menu_digest), site.menu_updated_at, build)
+
+@bp.route('/theme')
+@read_replica
+def theme():
+    """Site name, colors, logo and compiled stylesheet of the theme"""
+    site = site_context.get()
+    theme = site.theme
+
+    def build():
+        if theme is None:
+            return {}
+        return {
+            'site_name': theme.site_name,
+            'colors': {
+                'primary': theme.primary_color,
+                'secondary': theme.secondary_color,
+                'accent': theme.accent_color,
+                'background': theme.background_color,
+                'text': theme.text_color,
+            },
+            'logo': media_url(theme.logo, _external=True) if theme.logo else None,
+            'favicon': media_url(theme.favicon, _external=True) if theme.favicon else None,
+            'footer_text': theme.footer_text,
+            'stylesheet': url_for('static', filename=site.stylesheet, _external=True),
+            'updated_at': _timestamp(theme.updated_at),
+        }
+    updated_at = theme.updated_at if theme else None
+    return _conditional(make_etag('theme', updated_at, site.stylesheet), updated_at, build)
@@ -1,28 +1,89 @@
-from flask import Blueprint, render_template, abort
-from app.models import Page, Theme
+from flask import Blueprint, render_template, make_response, abort, request, current_app
+from app import page_cache, site_context, sitemaps
+from app.http_cache import make_etag, latest, set_validators, not_modified
+from app.models import Page
+from app.search import search_pages
+from app.database import read_replica
 
 bp = Blueprint('main', __name__)
 
+def _validators(page_state, site):
+    """ETag and Last-Modified of a page rendered with the current theme and menu
+
+    The site version covers the writes that change the rendering without
+    touching the page or the theme row (theme logo derivatives, media).
+    """
+    theme_updated_at = site.theme.updated_at if site.theme else None
+    page_id, page_updated_at = page_state if page_state else (None, None)
+    etag = make_etag(page_id, page_updated_at, theme_updated_at, site.menu_digest, site.version)
+    return etag, latest(page_updated_at, theme_updated_at, site.menu_updated_at, site.updated_at)
+
+def _render(template, page_state, site):
+    """Render a public page, answering 304 first when the client copy is fresh"""
+    conditional = page_cache.is_cacheable_request()
+    if conditional:
+        etag, last_modified = _validators(page_state, site)
+        response = not_modified(etag, last_modified)
+        if response is not None:
+            return response
+
+    page = Page.query.get(page_state.id) if page_state else None
+    response = make_response(render_template(template,
+                                             page=page,
+                                             theme=site.theme,
+                                             menu_pages=site.menu_pages))
+    if conditional:
+        set_validators(response, etag, last_modified)
+    return response
+
 @bp.route('/')
+@read_replica
+@page_cache.cached
 def index():
     """Homepage"""
-    theme = Theme.query.first()
-    home_page = Page.query.filter_by(slug='home', is_published=True).first()
-    menu_pages = Page.query.filter_by(show_in_menu=True, is_published=True).order_by(Page.menu_order).all()
-
-    return render_template('pages/index.html',
-                         page=home_page,
-                         theme=theme,
-                         menu_pages=menu_pages)
+    home_state = Page.query.with_entities(Page.id, Page.updated_at).filter_by(slug='home', is_published=True).first()
+    return _render('pages/index.html', home_state, site_context.get())
 
 @bp.route('/page/<slug>')
+@read_replica
+@page_cache.cached
 def page(slug):
     """Dynamic page view"""
-    page = Page.query.filter_by(slug=slug, is_published=True).first_or_404()
-    theme = Theme.query.first()
-    menu_pages = Page.query.filter_by(show_in_menu=True, is_published=True).order_by(Page.menu_order).all()
-
-    return render_template('pages/view.html',
-                         page=page,
-                         theme=theme,
-                         menu_pages=menu_pages)
+    page_state = Page.query.with_entities(Page.id, Page.updated_at).filter_by(slug=slug, is_published=True).first_or_404()
+    return _render('pages/view.html', page_state, site_context.get())
+
+# Sitemaps and feed are cached until the next admin write: they are
+# generated from the primary, a lagging replica would keep them stale
+@bp.route('/sitemap.xml')
+def sitemap():
+    """Sitemap of the published pages, or index of the sitemap files"""
+    return sitemaps.serve('sitemap.xml', 'application/xml', sitemaps.sitemap)
+
+@bp.route('/sitemap-<int:number>.xml')
+def sitemap_part(number):
+    """One file of a sitemap index"""
+    return sitemaps.serve(f'sitemap-{number}.xml', 'application/xml', lambda: sitemaps.sitemap_part(number),
+                          listed=lambda: sitemaps.has_part(number))
+
+@bp.route('/feed.atom')
+def feed():
+    """Atom feed of the recently updated pages"""
+    return sitemaps.serve('feed.atom', 'application/atom+xml', sitemaps.feed)
+
+@bp.route('/search')
+@read_replica
+def search():
+    """Full-text search over the published pages"""
+    query = request.args.get('q', '').strip()
+    page_number = max(request.args.get('p', 1, type=int), 1)
+    per_page = current_app.config['SEARCH_PAGE_SIZE']
+    # One extra row tells whether there is a next page without counting
+    results = search_pages(query, limit=per_page + 1, offset=(page_number - 1) * per_page) if query else []
+    site = site_context.get()
+    return render_template('pages/search.html',
+                           query=query,
+                           results=results[:per_page],
+                           page_number=page_number,
+                           has_next=len(results) > per_page,
+                           theme=site.theme,
+                           menu_pages=site.menu_pages)
@@ -0,0 +1,51 @@
+import mimetypes
+import os
+from urllib.parse import quote
+from flask import Blueprint, current_app, request, abort
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+from app.http_cache import make_immutable
+from app.storage import is_blob, is_spooled
+
+bp = Blueprint('media', __name__)
+
+@bp.route('/media/<path:filename>')
+def file(filename):
+    """Serve an uploaded file, or hand it over to the front proxy"""
+    upload_folder = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+    path = safe_join(upload_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    # Checks below apply to the normalized name (no ./ or dir/../ detours)
+    filename = os.path.relpath(path, upload_folder).replace(os.sep, '/')
+    if is_spooled(filename):
+        # Half-written upload, not a stored file
+        abort(404)
+
+    offload = current_app.config.get('MEDIA_SENDFILE')
+    # Blob names contain the content hash, a strong ETag for free
+    etag = os.path.splitext(os.path.basename(filename))[0] if is_blob(filename) else True
+    environ = request.environ
+    if offload:
+        # Ranges are served by the proxy from the whole file
+        environ = {k: v for k, v in environ.items() if k not in ('HTTP_RANGE', 'HTTP_IF_RANGE')}
+    response = send_file(path, environ,
+                         mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                         etag=etag,
+                         conditional=True,
+                         use_x_sendfile=bool(offload),
+                         response_class=current_app.response_class)
+
+    response.accept_ranges = 'bytes'
+    if offload == 'x-accel-redirect':
+        # nginx resolves the internal location and serves ranges itself
+        del response.headers['X-Sendfile']
+        response.headers['X-Accel-Redirect'] = current_app.config['MEDIA_ACCEL_PREFIX'] + quote(filename)
+
+    if is_blob(filename):
+        make_immutable(response)
+    else:
+        # Files uploaded before the blob store are not named by content
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,193 @@
+"""Full-text search over pages (SQLite FTS5)
+
+The page_search virtual table holds the title and the text of each page
+with the HTML stripped, its rowid being the page id. It is written in the
+same transaction as the page itself by the admin views, and rebuilt from
+the page table by `flask search rebuild`. Other databases fall back to a
+LIKE search on the page columns.
+"""
+import re
+from collections import namedtuple
+from html import unescape
+from html.parser import HTMLParser
+from markupsafe import Markup, escape
+from sqlalchemy import Integer, column, text
+
+SEARCH_TABLE = 'page_search'
+
+# Private-use characters wrapped around matches by FTS5, replaced by <mark>
+# once the text is escaped
+_MARK_START, _MARK_END = '', ''
+
+# Matches in the title weigh more than matches in the body
+_RANK = f'bm25({SEARCH_TABLE}, 10.0, 1.0)'
+
+SearchResult = namedtuple('SearchResult', ['id', 'title', 'slug', 'updated_at', 'title_html', 'snippet_html'])
+
+
+class _TextExtractor(HTMLParser):
+    skipped_tags = {'script', 'style', 'template'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skipped_tags:
+            self._skipping += 1
+        # Tags separate words even without whitespace around them
+        self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in self.skipped_tags and self._skipping:
+            self._skipping -= 1
+        self.parts.append(' ')
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def strip_html(html):
+    """Visible text of an HTML fragment, whitespace collapsed"""
+    if not html:
+        return ''
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return ' '.join(unescape(''.join(extractor.parts)).split())
+
+
+def is_supported(connection):
+    """Whether the database behind a connection or engine has the FTS table"""
+    return connection.dialect.name == 'sqlite'
+
+
+def create_search_table(connection):
+    if is_supported(connection):
+        connection.execute(text(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} '
+            "USING fts5(title, body, tokenize='unicode61 remove_diacritics 2')"
+        ))
+
+
+def rebuild_search_index(connection, batch_size=1000):
+    """Re-index every page from the page table, returns the number indexed"""
+    if not is_supported(connection):
+        return 0
+    create_search_table(connection)
+    connection.execute(text(f'DELETE FROM {SEARCH_TABLE}'))
+    insert = text(f'INSERT INTO {SEARCH_TABLE} (rowid, title, body) VALUES (:id, :title, :body)')
+    count = 0
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            text('SELECT id, title, content FROM page WHERE id > :last_id ORDER BY id LIMIT :limit'),
+            {'last_id': last_id, 'limit': batch_size}
+        ).fetchall()
+        if not rows:
+            break
+        connection.execute(insert, [
+            {'id': row.id, 'title': row.title, 'body': strip_html(row.content)} for row in rows
+        ])
+        count += len(rows)
+        last_id = rows[-1].id
+    connection.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+    return count
+
+
+def index_page(page):
+    """Write a page into the index, as part of the current transaction
+
+    The page must have been flushed so it has an id.
+    """
+    from app import db
+    if not is_supported(db.session.get_bind()):
+        return
+    remove_page(page.id)
+    db.session.execute(
+        text(f'INSERT INTO {SEARCH_TABLE} (rowid, title, body) VALUES (:id, :title, :body)'),
+        {'id': page.id, 'title': page.title, 'body': strip_html(page.content)}
+    )
+
+
+def remove_page(page_id):
+    """Drop a page from the index, as part of the current transaction"""
+    remove_pages([page_id])
+
+
+def remove_pages(page_ids):
+    """Drop several pages from the index in one statement"""
+    from app import db
+    from sqlalchemy import bindparam
+    if page_ids and is_supported(db.session.get_bind()):
+        db.session.execute(
+            text(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN :ids').bindparams(bindparam('ids', expanding=True)),
+            {'ids': list(page_ids)}
+        )
+
+
+def match_expression(query):
+    """FTS5 query matching every word of a user query, None if it has none
+
+    Words are quoted so operators typed by visitors are taken literally,
+    and the last one matches as a prefix for partially typed words.
+    """
+    words = re.findall(r'\w+', query or '')
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def matching_page_ids(query):
+    """Subquery of the ids of the pages matching a user query, for Page.id.in_()"""
+    return text(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match') \
+        .bindparams(match=match_expression(query) or '""') \
+        .columns(column('rowid', Integer))
+
+
+def _highlighted(value):
+    return Markup(str(escape(value or '')).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+
+
+def search_pages(query, published_only=True, limit=20, offset=0):
+    """Pages matching a user query, best matches first, with highlights"""
+    from app import db
+    match = match_expression(query)
+    if match is None:
+        return []
+    if not is_supported(db.session.get_bind()):
+        return _search_pages_like(query, published_only, limit, offset)
+
+    published = 'AND page.is_published = 1' if published_only else ''
+    rows = db.session.execute(text(f'''
+        SELECT page.id, page.title, page.slug, page.updated_at,
+               highlight({SEARCH_TABLE}, 0, :start, :end) AS title_html,
+               snippet({SEARCH_TABLE}, 1, :start, :end, '…', 32) AS snippet_html
+        FROM {SEARCH_TABLE} JOIN page ON page.id = {SEARCH_TABLE}.rowid
+        WHERE {SEARCH_TABLE} MATCH :match {published}
+        ORDER BY {_RANK}
+        LIMIT :limit OFFSET :offset
+    '''), {'match': match, 'start': _MARK_START, 'end': _MARK_END, 'limit': limit, 'offset': offset})
+    return [
+        SearchResult(row.id, row.title, row.slug, row.updated_at,
+                     _highlighted(row.title_html), _highlighted(row.snippet_html))
+        for row in rows
+    ]
+
+
+def _search_pages_like(query, published_only, limit, offset):
+    from sqlalchemy import or_
+    from app.models import Page
+    pages = Page.query.filter(or_(Page.title.ilike(f'%{query}%'), Page.content.ilike(f'%{query}%')))
+    if published_only:
+        pages = pages.filter(Page.is_published.is_(True))
+    pages = pages.order_by(Page.updated_at.desc()).limit(limit).offset(offset)
+    return [
+        SearchResult(page.id, page.title, page.slug, page.updated_at,
+                     escape(page.title), escape(strip_html(page.content)[:200]))
+        for page in pages
+    ]
@@ -0,0 +1,186 @@
+"""Site-wide context (theme and menu) shared by the public pages"""
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app, g
+
+DerivativeSnapshot = namedtuple('DerivativeSnapshot', ['name', 'format', 'filename', 'width', 'height'])
+
+MediaSnapshot = namedtuple('MediaSnapshot', [
+    'id', 'filename', 'original_filename', 'alt_text', 'width', 'height', 'derivatives'
+])
+
+ThemeSnapshot = namedtuple('ThemeSnapshot', [
+    'site_name', 'primary_color', 'secondary_color', 'accent_color',
+    'background_color', 'text_color', 'logo', 'favicon', 'footer_text', 'updated_at'
+])
+
+MenuItem = namedtuple('MenuItem', ['id', 'title', 'slug', 'menu_order', 'updated_at'])
+
+SiteContext = namedtuple('SiteContext', [
+    'version', 'updated_at', 'theme', 'menu_pages', 'menu_digest', 'menu_updated_at', 'stylesheet'
+])
+
+
+def _snapshot_media(media):
+    if media is None:
+        return None
+    derivatives = tuple(
+        DerivativeSnapshot(d.name, d.format, d.filename, d.width, d.height) for d in media.derivatives
+    )
+    return MediaSnapshot(media.id, media.filename, media.original_filename, media.alt_text,
+                         media.width, media.height, derivatives)
+
+
+def _snapshot_theme(theme):
+    if theme is None:
+        return None
+    return ThemeSnapshot(
+        site_name=theme.site_name,
+        primary_color=theme.primary_color,
+        secondary_color=theme.secondary_color,
+        accent_color=theme.accent_color,
+        background_color=theme.background_color,
+        text_color=theme.text_color,
+        logo=_snapshot_media(theme.logo),
+        favicon=_snapshot_media(theme.favicon),
+        footer_text=theme.footer_text,
+        updated_at=theme.updated_at
+    )
+
+
+def read_site_versions():
+    """(site version, users version) as stored in the database (0 if never bumped)"""
+    from app import db
+    from app.models import SiteState
+    row = db.session.query(SiteState.version, SiteState.users_version).filter_by(id=1).first()
+    return (row.version or 0, row.users_version or 0) if row else (0, 0)
+
+
+def bump_site_version(menu_changed=False):
+    """Increment the site version as part of the current transaction
+
+    Must be called before committing any admin write that changes what
+    the public pages render, so every worker rebuilds its context.
+    Pass menu_changed=True when the write adds, removes or alters a menu entry.
+    """
+    from app import db
+    from app.models import SiteState
+    now = datetime.utcnow()
+    values = {SiteState.version: SiteState.version + 1, SiteState.updated_at: now}
+    menu_updated_at = now if menu_changed else None
+    if menu_changed:
+        values[SiteState.menu_updated_at] = menu_updated_at
+    updated = SiteState.query.filter_by(id=1).update(values, synchronize_session=False)
+    if not updated:
+        db.session.add(SiteState(id=1, version=1, updated_at=now, menu_updated_at=menu_updated_at))
+
+
+def bump_users_version(executor):
+    """Increment the users version as part of the current transaction
+
+    Called on every flush writing a user row, so the user caches of all
+    workers drop their snapshots. executor is a session or a connection.
+    """
+    from sqlalchemy import func
+    from app.models import SiteState
+    table = SiteState.__table__
+    updated = executor.execute(table.update()
+                               .where(table.c.id == 1)
+                               .values(users_version=func.coalesce(table.c.users_version, 0) + 1))
+    if not updated.rowcount:
+        executor.execute(table.insert().values(id=1, version=1, users_version=1))
+
+
+class SiteContextCache:
+    """Per-process theme and menu snapshot revalidated against the site version
+
+    The version is read from the database at most once per request, and at
+    most once every SITE_VERSION_CHECK_INTERVAL milliseconds per process.
+    The snapshot is only rebuilt when another admin write bumped it, which
+    keeps every prefork worker consistent without sharing memory. The
+    users version is read along with it, for the user cache.
+    """
+
+    def __init__(self, app=None):
+        self._context = None
+        self._version = None
+        self._users_version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['site_context'] = self
+
+    def current_version(self):
+        """Site version, revalidated according to the check interval"""
+        if 'site_version' in g:
+            return g.site_version
+
+        interval = current_app.config.get('SITE_VERSION_CHECK_INTERVAL', 0) / 1000
+        now = time.monotonic()
+        if self._version is None or now - self._checked_at >= interval:
+            self._version, self._users_version = read_site_versions()
+            self._checked_at = now
+
+        g.site_version = self._version
+        g.users_version = self._users_version
+        return self._version
+
+    def current_users_version(self):
+        """Users version, revalidated along with the site version"""
+        if 'users_version' not in g:
+            self.current_version()
+        return g.users_version
+
+    def expire(self):
+        """Force a version check on the next request (after a local write)"""
+        self._version = None
+        g.pop('site_version', None)
+        g.pop('users_version', None)
+
+    def get(self):
+        """Return the SiteContext, rebuilding it if the version moved"""
+        version = self.current_version()
+        context = self._context
+        if context is None or context.version != version:
+            with self._lock:
+                context = self._context
+                if context is None or context.version != version:
+                    context = self._build(version)
+                    self._context = context
+        return context
+
+    @staticmethod
+    def _build(version):
+        from app.assets import theme_stylesheet
+        from app.models import Page, Theme, SiteState
+        theme = Theme.query.first()
+        menu_pages = (Page.query
+                      .with_entities(Page.id, Page.title, Page.slug, Page.menu_order, Page.updated_at)
+                      .filter_by(show_in_menu=True, is_published=True)
+                      .order_by(Page.menu_order)
+                      .all())
+        state = SiteState.query.with_entities(SiteState.updated_at, SiteState.menu_updated_at).filter_by(id=1).first()
+        updated_at, menu_updated_at = state if state else (None, None)
+
+        menu = [MenuItem(*row) for row in menu_pages]
+        digest = hashlib.sha1(repr([(m.id, m.title, m.slug, m.menu_order) for m in menu]).encode('utf-8'))
+        if menu_updated_at is None:
+            # Menu never changed through the admin, fall back to its pages
+            menu_updated_at = max((m.updated_at for m in menu if m.updated_at is not None), default=None)
+
+        theme = _snapshot_theme(theme)
+        return SiteContext(
+            version=version,
+            updated_at=updated_at,
+            theme=theme,
+            menu_pages=menu,
+            menu_digest=digest.hexdigest(),
+            menu_updated_at=menu_updated_at,
+            stylesheet=theme_stylesheet(theme)
+        )
@@ -0,0 +1,258 @@
+"""sitemap.xml and Atom feed, streamed from the database and cached on disk
+
+Files are generated on the first request after a change: rows are read
+in id order with yield_per and each chunk of XML is sent to the client
+while it is written to a temporary file, renamed into SITEMAP_DIR once
+complete, along with its .gz/.br variants. Later requests are served
+from those files until an admin page write calls invalidate(), which
+bumps a generation marker so a file still being written by another
+request is discarded instead of installed.
+
+Past SITEMAP_MAX_URLS published pages, sitemap.xml becomes a sitemap
+index of sitemap-<n>.xml files, the n-th covering the ids in
+[n * SITEMAP_MAX_URLS, (n + 1) * SITEMAP_MAX_URLS), so each stays under
+the limit and is read with a primary key range scan.
+
+Cached files are shared by every client, so their URLs are built on the
+canonical address of the site (SITE_URL, or SERVER_NAME), never on the
+Host header of the request that generated them. Without one, the files
+are generated for each request and not cached, and a warning is logged
+at startup.
+"""
+import os
+import tempfile
+import uuid
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape
+from flask import abort, current_app, request, send_file, stream_with_context, url_for
+from sqlalchemy import func, select
+from app.assets import ENCODINGS
+from app.compression import compress_file
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+
+_GENERATION = 'generation'
+
+# Rows fetched per round trip while streaming
+BATCH_SIZE = 1000
+
+
+def _cache_dir():
+    cache_dir = current_app.config.get('SITEMAP_DIR') or os.path.join(current_app.instance_path, 'sitemaps')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def _generation(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, _GENERATION)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return ''
+
+
+def invalidate():
+    """Drop the generated files, after a committed page write"""
+    cache_dir = _cache_dir()
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, 'w') as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmp_path, os.path.join(cache_dir, _GENERATION))
+    for name in os.listdir(cache_dir):
+        if name.endswith(('.xml', '.atom')) or name.endswith(tuple(suffix for _encoding, suffix in ENCODINGS)):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+
+def canonical_url():
+    """Base URL the cached files point to, None when not configured"""
+    config = current_app.config
+    if config.get('SITE_URL'):
+        return config['SITE_URL']
+    if config.get('SERVER_NAME'):
+        return f"{config.get('PREFERRED_URL_SCHEME', 'http')}://{config['SERVER_NAME']}{config.get('APPLICATION_ROOT', '/')}"
+    return None
+
+
+def check_site_url(app):
+    """Warn at startup when the files cannot be cached for lack of a canonical address"""
+    if not (app.config.get('SITE_URL') or app.config.get('SERVER_NAME')):
+        app.logger.warning('SITE_URL is not set: sitemap.xml, sitemap-<n>.xml and feed.atom '
+                           'are generated on every request instead of cached')
+
+
+def _url_builder():
+    """url(endpoint, **values) returning absolute URLs on the canonical address"""
+    base = canonical_url()
+    if base is None:
+        # Not cached: the address the client used is fine for its own copy
+        return lambda endpoint, **values: url_for(endpoint, _external=True, **values)
+    parts = urlsplit(base)
+    adapter = current_app.url_map.bind(parts.netloc, script_name=parts.path or '/', url_scheme=parts.scheme)
+    return lambda endpoint, **values: adapter.build(endpoint, values, force_external=True)
+
+
+def _w3c(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ') if value else None
+
+
+def _tee(chunks, cache_dir, name):
+    """Yield encoded chunks while writing them to cache_dir/name"""
+    generation = _generation(cache_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    completed = False
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                data = chunk.encode('utf-8')
+                f.write(data)
+                yield data
+        completed = True
+    finally:
+        # Incomplete (client gone) or outdated (pages changed meanwhile): discard
+        if completed and _generation(cache_dir) == generation:
+            path = os.path.join(cache_dir, name)
+            os.replace(tmp_path, path)
+            for encoding, suffix in ENCODINGS:
+                compress_file(path, path + suffix, encoding)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _encode(chunks):
+    for chunk in chunks:
+        yield chunk.encode('utf-8')
+
+
+def serve(name, mimetype, generate, listed=None):
+    """Response for a generated file: from the cache, or streamed while caching it
+
+    listed() tells, before generating, whether the file exists at all (404
+    otherwise), so clients cannot fill SITEMAP_DIR with arbitrary names.
+    """
+    if canonical_url() is None:
+        if listed is not None and not listed():
+            abort(404)
+        response = current_app.response_class(stream_with_context(_encode(generate())), mimetype=mimetype)
+        response.headers['Cache-Control'] = current_app.config.get('PAGE_CACHE_CONTROL', 'public, no-cache')
+        return response
+    cache_dir = _cache_dir()
+    path = os.path.join(cache_dir, name)
+    if not os.path.isfile(path):
+        if listed is not None and not listed():
+            abort(404)
+        response = current_app.response_class(stream_with_context(_tee(generate(), cache_dir, name)),
+                                               mimetype=mimetype)
+    else:
+        encoding = None
+        for candidate, suffix in ENCODINGS:
+            if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+                encoding, path = candidate, path + suffix
+                break
+        response = send_file(path, mimetype=mimetype, conditional=True)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = current_app.config.get('PAGE_CACHE_CONTROL', 'public, no-cache')
+    return response
+
+
+def _published_chunks():
+    """(chunk number, published pages, last update) of every id range holding published pages"""
+    from app import db
+    from app.models import Page
+    size = current_app.config['SITEMAP_MAX_URLS']
+    chunk = (Page.id // size).label('chunk')
+    rows = db.session.execute(
+        select(chunk, func.count(Page.id), func.max(Page.updated_at))
+        .where(Page.is_published.is_(True))
+        .group_by(chunk)
+        .order_by(chunk)
+    )
+    return [(int(number), count, updated_at) for number, count, updated_at in rows]
+
+
+def _is_index(chunks):
+    return sum(count for _number, count, _updated_at in chunks) > current_app.config['SITEMAP_MAX_URLS']
+
+
+def has_part(number):
+    """Whether /sitemap-<number>.xml is listed by the sitemap index"""
+    chunks = _published_chunks()
+    return _is_index(chunks) and any(n == number for n, _count, _updated_at in chunks)
+
+
+def _urlset(id_range=None):
+    from app import db
+    from app.models import Page
+    url = _url_builder()
+    query = select(Page.slug, Page.updated_at).where(Page.is_published.is_(True)).order_by(Page.id)
+    if id_range is not None:
+        query = query.where(Page.id >= id_range[0], Page.id < id_range[1])
+
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NS}">\n'
+    buffer = []
+    for slug, updated_at in db.session.execute(query.execution_options(yield_per=BATCH_SIZE)):
+        loc = url('main.index') if slug == 'home' else url('main.page', slug=slug)
+        buffer.append(f'<url><loc>{escape(loc)}</loc><lastmod>{_w3c(updated_at)}</lastmod></url>\n')
+        if len(buffer) >= BATCH_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+    buffer.append('</urlset>\n')
+    yield ''.join(buffer)
+
+
+def sitemap():
+    """Chunks of /sitemap.xml: the URLs, or an index of the sitemap files"""
+    chunks = _published_chunks()
+    if not _is_index(chunks):
+        yield from _urlset()
+        return
+    url = _url_builder()
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{SITEMAP_NS}">\n'
+    for number, _count, updated_at in chunks:
+        loc = escape(url('main.sitemap_part', number=number))
+        yield f'<sitemap><loc>{loc}</loc><lastmod>{_w3c(updated_at)}</lastmod></sitemap>\n'
+    yield '</sitemapindex>\n'
+
+
+def sitemap_part(number):
+    """Chunks of /sitemap-<number>.xml"""
+    size = current_app.config['SITEMAP_MAX_URLS']
+    yield from _urlset((number * size, (number + 1) * size))
+
+
+def feed():
+    """Chunks of the Atom feed of the most recently updated pages"""
+    from app import db, site_context
+    from app.models import Page
+    from app.search import strip_html
+    theme = site_context.get().theme
+    title = theme.site_name if theme else ''
+    rows = db.session.execute(
+        select(Page.slug, Page.title, Page.content, Page.updated_at)
+        .where(Page.is_published.is_(True))
+        .order_by(Page.updated_at.desc(), Page.id.desc())
+        .limit(current_app.config['FEED_SIZE'])
+    ).all()
+    url = _url_builder()
+    home = url('main.index')
+    self_url = url('main.feed')
+    updated = rows[0].updated_at if rows else None
+
+    yield (f'<?xml version="1.0" encoding="UTF-8"?>\n<feed xmlns="{ATOM_NS}">\n'
+           f'<title>{escape(title)}</title>\n<id>{escape(home)}</id>\n'
+           f'<link href="{escape(home)}"/>\n<link rel="self" href="{escape(self_url)}"/>\n'
+           f'<author><name>{escape(title)}</name></author>\n'
+           f'<updated>{_w3c(updated) or "1970-01-01T00:00:00Z"}</updated>\n')
+    for row in rows:
+        loc = escape(url('main.page', slug=row.slug))
+        summary = strip_html(row.content)
+        if len(summary) > 300:
+            summary = summary[:300].rsplit(' ', 1)[0] + '…'
+        yield (f'<entry><title>{escape(row.title)}</title><id>{loc}</id><link href="{loc}"/>'
+               f'<updated>{_w3c(row.updated_at)}</updated><summary>{escape(summary)}</summary></entry>\n')
+    yield '</feed>\n'
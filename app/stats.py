@@ -0,0 +1,116 @@
+"""Content counters of the admin dashboard, kept in the site_stats row
+
+COUNT(*) and SUM() over the page, media and user tables read every row on
+most databases, so the dashboard reads a single row instead. It is kept
+up to date in the transaction of each change: a before_flush listener
+turns the pages, media and users added, deleted or (un)published into
+deltas, applied by one UPDATE after the flush. Set-based statements that
+bypass the unit of work (the admin batch actions) call adjust()
+themselves, and `flask db reconcile-stats` recounts everything after
+writes made outside the app.
+"""
+from collections import Counter
+from sqlalchemy import case, func, inspect, select
+
+FIELDS = ('pages', 'published_pages', 'media', 'media_bytes', 'users')
+
+
+def init_stats(app):
+    """Keep the counters in step with the flushes of the app session"""
+    from sqlalchemy import event
+    from app import db
+    if not event.contains(db.session, 'before_flush', _collect_deltas):
+        event.listen(db.session, 'before_flush', _collect_deltas)
+        event.listen(db.session, 'after_flush', _apply_deltas)
+
+
+def _change(obj, attribute, convert):
+    """Difference between the new and the loaded value of an attribute, converted"""
+    history = inspect(obj).attrs[attribute].history
+    if not (history.added and history.deleted):
+        return 0
+    return convert(history.added[0]) - convert(history.deleted[0])
+
+
+def _collect_deltas(session, flush_context, instances):
+    from app.models import Page, Media, User
+    deltas = Counter()
+    for sign, objects in ((1, session.new), (-1, session.deleted)):
+        for obj in objects:
+            if isinstance(obj, Page):
+                deltas['pages'] += sign
+                deltas['published_pages'] += sign * bool(obj.is_published)
+            elif isinstance(obj, Media):
+                deltas['media'] += sign
+                deltas['media_bytes'] += sign * (obj.file_size or 0)
+            elif isinstance(obj, User):
+                deltas['users'] += sign
+    for obj in session.dirty:
+        if isinstance(obj, Page):
+            deltas['published_pages'] += _change(obj, 'is_published', bool)
+        elif isinstance(obj, Media):
+            deltas['media_bytes'] += _change(obj, 'file_size', lambda value: value or 0)
+    # Replaced on every flush, so a failed one leaves nothing behind
+    session.info['stats_deltas'] = {name: delta for name, delta in deltas.items() if delta}
+
+
+def _apply_deltas(session, flush_context):
+    deltas = session.info.pop('stats_deltas', None)
+    if deltas:
+        adjust(session.connection(), **deltas)
+
+
+def adjust(executor, **deltas):
+    """Add deltas to the counters, as part of the current transaction
+
+    Call it after the statements it accounts for: when the row does not
+    exist yet it is created from a full count, which includes them.
+    executor is a session or a connection.
+    """
+    from app.models import SiteStats
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    table = SiteStats.__table__
+    updated = executor.execute(table.update()
+                               .where(table.c.id == 1)
+                               .values({table.c[name]: table.c[name] + delta for name, delta in deltas.items()}))
+    if not updated.rowcount:
+        executor.execute(table.insert().values(id=1, **count_all(executor)))
+
+
+def count_all(executor):
+    """Counters computed from the tables (full scans)"""
+    from app.models import Page, Media, User
+    pages, published_pages = executor.execute(
+        select(func.count(Page.id), func.coalesce(func.sum(case((Page.is_published.is_(True), 1), else_=0)), 0))
+    ).one()
+    media, media_bytes = executor.execute(
+        select(func.count(Media.id), func.coalesce(func.sum(Media.file_size), 0))
+    ).one()
+    users = executor.execute(select(func.count(User.id))).scalar()
+    return {'pages': pages, 'published_pages': published_pages, 'media': media,
+            'media_bytes': media_bytes, 'users': users}
+
+
+def reconcile(connection):
+    """Recount and store the counters, returns (stored before or None, recounted)"""
+    from app.models import SiteStats
+    table = SiteStats.__table__
+    row = connection.execute(select(*(table.c[name] for name in FIELDS)).where(table.c.id == 1)).first()
+    counts = count_all(connection)
+    if row is None:
+        connection.execute(table.insert().values(id=1, **counts))
+        return None, counts
+    connection.execute(table.update().where(table.c.id == 1).values(**counts))
+    return dict(row._mapping), counts
+
+
+def read_stats():
+    """The counters row; counted from the tables (not stored) before the first write"""
+    from app import db
+    from app.models import SiteStats
+    stats = db.session.get(SiteStats, 1)
+    if stats is None:
+        stats = SiteStats(id=1, **count_all(db.session))
+    return stats
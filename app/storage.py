@@ -0,0 +1,205 @@
+"""Content-addressed, deduplicated storage of uploaded files
+
+Uploads are streamed to disk while their SHA-256 is computed, then stored
+once under uploads/blobs/<ab>/<cd>/<sha256><ext>. Each Blob row counts the
+Media rows referencing it and the file is only removed with the last one.
+"""
+import hashlib
+import os
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from app.jobs import job
+
+CHUNK_SIZE = 64 * 1024
+BLOB_DIR = 'blobs'
+SPOOL_DIR = 'tmp'  # uploads being written and hashed, under BLOB_DIR
+
+
+def is_spooled(filename):
+    """Whether a path relative to UPLOAD_FOLDER is an upload still being written"""
+    return filename.startswith(f'{BLOB_DIR}/{SPOOL_DIR}/')
+
+
+def is_blob(filename):
+    """Whether a path relative to UPLOAD_FOLDER is a stored file of the blob store
+
+    Blob files and their derivatives are named after the content hash, so
+    their URLs never change meaning and can be cached forever.
+    """
+    return filename.startswith(f'{BLOB_DIR}/') and not is_spooled(filename)
+
+
+def blob_filename(sha256, ext):
+    """Path of a blob relative to UPLOAD_FOLDER, sharded on the hash prefix"""
+    return '/'.join((BLOB_DIR, sha256[:2], sha256[2:4], sha256 + ext.lower()))
+
+
+def _spool(stream, upload_folder):
+    """Copy a stream to a temporary file in chunks, hashing it on the way"""
+    tmp_dir = os.path.join(upload_folder, BLOB_DIR, SPOOL_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return digest.hexdigest(), tmp_path, size
+
+
+def _insert_blob(blob):
+    """Insert a new Blob in a savepoint, False if the same content was inserted since the lookup"""
+    from sqlalchemy.exc import IntegrityError
+    from app import db
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(blob)
+    except IntegrityError:
+        return False
+    return True
+
+
+def _reference_blob(blob, sha256, tmp_path, size, upload_folder, ext, references=1):
+    """Create or count references on the Blob of a spooled file, then move it in place"""
+    from app import db
+    from app.models import Blob
+
+    created = False
+    if blob is None:
+        filename = blob_filename(sha256, ext)
+        blob = Blob(sha256=sha256,
+                    filename=filename,
+                    file_path=os.path.join(upload_folder, filename),
+                    file_size=size,
+                    ref_count=references)
+        created = _insert_blob(blob)
+        if not created:
+            # A concurrent upload of the same content committed it first
+            blob = db.session.get(Blob, sha256)
+    if not created:
+        blob.ref_count = Blob.ref_count + references
+
+    if os.path.exists(blob.file_path):
+        # Same content already on disk
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(blob.file_path), exist_ok=True)
+        os.replace(tmp_path, blob.file_path)
+    return blob
+
+
+def store_upload(stream, upload_folder, ext):
+    """Store an uploaded stream and take a reference on its Blob
+
+    The Blob is added to the current session, the caller commits it along
+    with the Media row pointing to it.
+    """
+    from app.models import Blob
+
+    sha256, tmp_path, size = _spool(stream, upload_folder)
+    return _reference_blob(Blob.query.get(sha256), sha256, tmp_path, size, upload_folder, ext)
+
+
+def _spool_source(source, upload_folder):
+    open_stream, _ext = source
+    with open_stream() as stream:
+        return _spool(stream, upload_folder)
+
+
+def store_uploads(sources, upload_folder, workers=4):
+    """Store several uploads at once, returns their Blobs in order
+
+    Sources are (open_stream, ext) pairs. Files are copied and hashed
+    concurrently, then existing Blobs are looked up with a single query;
+    like store_upload(), the caller commits.
+    """
+    from app.models import Blob
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='uploads') as pool:
+        futures = [pool.submit(_spool_source, source, upload_folder) for source in sources]
+    try:
+        spooled = [future.result() for future in futures]
+    except BaseException:
+        for future in futures:
+            if future.exception() is None:
+                os.remove(future.result()[1])
+        raise
+
+    references = Counter(sha256 for sha256, _tmp_path, _size in spooled)
+    existing = {blob.sha256: blob for blob in Blob.query.filter(Blob.sha256.in_(references))}
+    blobs = {}
+    for (_open_stream, ext), (sha256, tmp_path, size) in zip(sources, spooled):
+        if sha256 in blobs:
+            # Same content twice in the batch, already referenced
+            os.remove(tmp_path)
+            continue
+        blobs[sha256] = _reference_blob(existing.get(sha256), sha256, tmp_path, size,
+                                        upload_folder, ext, references[sha256])
+    return [blobs[sha256] for sha256, _tmp_path, _size in spooled]
+
+
+def release_blob(blob):
+    """Drop a reference on a Blob, returns True when it was the last one
+
+    The Blob row is deleted in the current session; the caller removes the
+    files once the transaction is committed.
+    """
+    from app import db
+    from app.models import Blob
+
+    Blob.query.filter_by(sha256=blob.sha256).update(
+        {Blob.ref_count: Blob.ref_count - 1}, synchronize_session=False)
+    remaining = db.session.query(Blob.ref_count).filter_by(sha256=blob.sha256).scalar()
+    if remaining is not None and remaining > 0:
+        db.session.expire(blob)
+        return False
+    db.session.delete(blob)
+    return True
+
+
+def release_blobs(references):
+    """Drop references on several Blobs, given as {sha256: count}, in two statements
+
+    Returns the hashes left unreferenced, whose Blob rows are deleted; the
+    caller deletes the Media rows first and removes the files once committed.
+    """
+    from sqlalchemy import case
+    from app import db
+    from app.models import Blob
+
+    if not references:
+        return set()
+    Blob.query.filter(Blob.sha256.in_(references)).update(
+        {Blob.ref_count: Blob.ref_count - case(references, value=Blob.sha256, else_=0)},
+        synchronize_session=False)
+    released = {sha256 for (sha256,) in db.session.query(Blob.sha256)
+                .filter(Blob.sha256.in_(references), Blob.ref_count <= 0)}
+    if released:
+        Blob.query.filter(Blob.sha256.in_(released)).delete(synchronize_session=False)
+    return released
+
+
+@job('files.delete')
+def delete_files(paths):
+    """Remove released files, unless the same content was uploaded again since"""
+    from app import db
+    from app.models import Blob, MediaDerivative
+
+    in_use = {path for (path,) in db.session.query(Blob.file_path).filter(Blob.file_path.in_(paths))}
+    in_use.update(path for (path,) in db.session.query(MediaDerivative.file_path)
+                  .filter(MediaDerivative.file_path.in_(paths)))
+    for path in paths:
+        if path not in in_use and os.path.exists(path):
+            os.remove(path)
+
@@ -0,0 +1,23 @@
+"""Jinja bytecode cache and template precompilation"""
+import os
+from jinja2 import FileSystemBytecodeCache
+
+
+def init_bytecode_cache(app):
+    """Keep compiled templates on disk so new workers skip compilation"""
+    cache_dir = app.config.get('TEMPLATE_CACHE_DIR')
+    if cache_dir == '':
+        return
+    cache_dir = cache_dir or os.path.join(app.instance_path, 'template_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(cache_dir)}
+
+
+def precompile_templates(app):
+    """Compile every template, filling the bytecode cache and the in-memory
+    template cache of this process; returns the number of templates"""
+    env = app.jinja_env
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+    return len(names)
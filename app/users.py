@@ -0,0 +1,102 @@
+"""Cached user loading for Flask-Login"""
+import time
+from collections import namedtuple
+from flask_login import UserMixin
+from app.cache import NullCache, create_backend
+
+
+class UserSnapshot(UserMixin, namedtuple('UserSnapshot', ['id', 'username', 'email', 'is_admin'])):
+    """Read-only copy of the user columns needed to serve a request
+
+    Stands in for current_user so authenticated requests do not load the
+    ORM object; views that modify the user must query it explicitly.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, bool(user.is_admin))
+
+
+class UserCache:
+    """Bounded cache of user snapshots with a time-to-live
+
+    Entries are dropped after any committed write to a user row in this
+    process. Each write also bumps the users version stored next to the
+    site version, and entries record the version they were loaded under:
+    every other worker stops using them as soon as it revalidates the
+    site version (SITE_VERSION_CHECK_INTERVAL), whatever the backend.
+    """
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self.ttl = 60
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = create_backend(app, 'USER_CACHE', 'user_cache')
+        self.ttl = app.config.get('USER_CACHE_TTL', 60)
+        app.extensions['user_cache'] = self
+
+        from sqlalchemy import event
+        from app import db
+        if not event.contains(db.session, 'after_flush', self._collect_changes):
+            event.listen(db.session, 'after_flush', self._collect_changes)
+            event.listen(db.session, 'after_commit', self._invalidate_changes)
+            event.listen(db.session, 'after_rollback', self._discard_changes)
+
+    @staticmethod
+    def key_for(user_id):
+        return f'user/{user_id}'
+
+    def load(self, user_id):
+        """Snapshot of a user, from the cache or the database (None if unknown)"""
+        from app import db, site_context
+        from app.models import User
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+
+        version = site_context.current_users_version()
+        key = self.key_for(user_id)
+        entry = self.backend.get(key)
+        if entry is not None:
+            expires_at, entry_version, snapshot = entry if len(entry) == 3 else (0, None, None)
+            if expires_at > time.time() and entry_version == version:
+                return snapshot
+            self.backend.delete(key)
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = UserSnapshot.from_user(user)
+        self.backend.set(key, (time.time() + self.ttl, version, snapshot))
+        return snapshot
+
+    def invalidate(self, user_id):
+        """Drop the cached snapshot of a user"""
+        self.backend.delete(self.key_for(user_id))
+
+    @staticmethod
+    def _collect_changes(session, flush_context):
+        from app.models import User
+        from app.site import bump_users_version
+        changed = session.info.setdefault('changed_user_ids', set())
+        existing = False
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            if isinstance(obj, User) and obj.id is not None:
+                changed.add(obj.id)
+                existing = existing or obj not in session.new
+        if existing:
+            # Other workers may hold a snapshot of these users
+            bump_users_version(session.connection())
+
+    def _invalidate_changes(self, session):
+        for user_id in session.info.pop('changed_user_ids', ()):
+            self.invalidate(user_id)
+
+    @staticmethod
+    def _discard_changes(session):
+        session.info.pop('changed_user_ids', None)
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+HTTP benchmarks for the public, admin and upload paths
+
+    python benchmarks/bench.py run --scale medium --out results/abc123.json
+    python benchmarks/bench.py run --scale small --server --set PAGE_CACHE_TYPE=null
+    python benchmarks/bench.py compare results/before.json results/after.json
+    python benchmarks/bench.py startup --budget-ms 1500
+
+`run` seeds a throwaway SQLite database at the requested scale, drives the
+WSGI app either in-process (Flask test client) or through a local HTTP
+server, and records throughput, latency percentiles and SQL queries per
+request as JSON. `compare` diffs two result files and exits with status 1
+when a scenario regressed beyond the threshold. `startup` measures the
+cold start of a new worker process (imports, create_app, first request)
+with and without the template bytecode cache, and exits with status 1
+when the warm start exceeds the budget.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCALES = {
+    'small': {'pages': 100, 'media': 100, 'users': 10},
+    'medium': {'pages': 10_000, 'media': 2_000, 'users': 100},
+    'large': {'pages': 100_000, 'media': 5_000, 'users': 1_000},
+}
+
+SCENARIOS = ['index', 'page', 'login', 'admin_pages', 'admin_media', 'admin_users', 'media_upload']
+
+ADMIN_PASSWORD = 'bench-password'
+
+
+def seed(app, pages, media, users, seed):
+    """Fill an empty database with generated content, using bulk inserts
+
+    Returns the slugs of published pages to request.
+    """
+    from app import db
+    from app.models import User, Page, Theme, SiteState
+    from app.migrations import upgrade
+    from init_db import generate_bulk_data
+
+    with app.app_context():
+        upgrade()
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password(ADMIN_PASSWORD)
+        db.session.add(admin)
+        db.session.add(Theme())
+        db.session.add(SiteState(id=1, version=1))
+        db.session.add(Page(title='Accueil', slug='home', content='<p>Accueil</p>', is_published=True))
+        db.session.commit()
+
+        generate_bulk_data(users=max(0, users - 1), pages=max(0, pages - 1), media=media, seed=seed,
+                           log=lambda message: print(message, file=sys.stderr))
+        return [slug for slug, in Page.query.filter(Page.is_published.is_(True), Page.slug != 'home')
+                .with_entities(Page.slug).limit(10_000)]
+
+
+class QueryCounter:
+    """Counts SQL statements executed by the app"""
+
+    def __init__(self, app):
+        from sqlalchemy import event
+        from app import db
+        self.count = 0
+        with app.app_context():
+            event.listen(db.engine, 'after_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+
+def _image_bytes(rng):
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new('RGB', (64, 64), tuple(rng.randrange(256) for _ in range(3))).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+class InProcessClient:
+    """Drives the app through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+    def post(self, path, data, files=None):
+        if files:
+            data = dict(data, **{name: (io.BytesIO(content), filename, mime)
+                                 for name, (filename, content, mime) in files.items()})
+            return self.client.post(path, data=data, content_type='multipart/form-data').status_code
+        return self.client.post(path, data=data).status_code
+
+
+class HTTPClient:
+    """Drives the app through a local threaded HTTP server (keep-alive, cookies)"""
+
+    def __init__(self, app):
+        import http.client
+        import logging
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)  # no per-request access log
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.connection = http.client.HTTPConnection('127.0.0.1', self.server.server_port)
+        self.cookies = {}
+
+    def _request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        response.read()
+        for header in response.headers.get_all('Set-Cookie') or ():
+            name, _, rest = header.partition('=')
+            self.cookies[name] = rest.split(';', 1)[0]
+        return response.status
+
+    def get(self, path):
+        return self._request('GET', path)
+
+    def post(self, path, data, files=None):
+        if files:
+            boundary = 'bench-boundary'
+            parts = []
+            for name, value in data.items():
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+            for name, (filename, content, mime) in files.items():
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                             f'filename="{filename}"\r\nContent-Type: {mime}\r\n\r\n'.encode() + content + b'\r\n')
+            body = b''.join(parts) + f'--{boundary}--\r\n'.encode()
+            content_type = f'multipart/form-data; boundary={boundary}'
+        else:
+            from urllib.parse import urlencode
+            body = urlencode(data).encode()
+            content_type = 'application/x-www-form-urlencoded'
+        return self._request('POST', path, body, {'Content-Type': content_type})
+
+    def close(self):
+        self.connection.close()
+        self.server.shutdown()
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(name, call, counter, requests, warmup):
+    for _ in range(warmup):
+        call()
+    latencies = []
+    queries_before = counter.count
+    started = time.perf_counter()
+    for _ in range(requests):
+        t = time.perf_counter()
+        status = call()
+        latencies.append(time.perf_counter() - t)
+        if status >= 400:
+            raise RuntimeError(f'{name}: HTTP {status}')
+    total = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': requests,
+        'seconds': round(total, 4),
+        'rps': round(requests / total, 1),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+        'queries_per_request': round((counter.count - queries_before) / requests, 2),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _parse_overrides(values):
+    overrides = {}
+    for item in values:
+        key, _, value = item.partition('=')
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            parsed = None
+        overrides[key] = value if parsed is None else parsed
+    return overrides
+
+
+def run(args):
+    from config import Config
+    from app import create_app
+
+    rng = random.Random(args.seed)
+    counts = dict(SCALES[args.scale])
+    for key in ('pages', 'media', 'users'):
+        if getattr(args, key) is not None:
+            counts[key] = getattr(args, key)
+
+    workdir = tempfile.mkdtemp(prefix='cms-bench-')
+    overrides = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'PAGE_CACHE_DIR': os.path.join(workdir, 'page_cache'),
+        'WTF_CSRF_ENABLED': False,
+        'METRICS_SAMPLE_RATE': 0.0,
+        # The job dispatcher polls the database on its own thread, which
+        # QueryCounter would attribute to the requests being measured
+        'JOBS_EXECUTOR': 'none',
+    }
+    overrides.update(_parse_overrides(args.set))
+    app = create_app(type('BenchConfig', (Config,), overrides))
+
+    print(f'Seeding {counts} in {workdir}...', file=sys.stderr)
+    t = time.perf_counter()
+    published = seed(app, seed=args.seed, **counts) or ['home']
+    print(f'Seeded in {time.perf_counter() - t:.1f}s', file=sys.stderr)
+
+    counter = QueryCounter(app)
+    make_client = HTTPClient if args.server else InProcessClient
+    anonymous, admin, login_client = make_client(app), make_client(app), make_client(app)
+    login = {'username': 'admin', 'password': ADMIN_PASSWORD}
+    admin.post('/auth/login', login)
+
+    def login_once():
+        # Start logged out every time, otherwise the view just redirects
+        if isinstance(login_client, HTTPClient):
+            login_client.cookies.clear()
+            return login_client.post('/auth/login', login)
+        return InProcessClient(app).post('/auth/login', login)
+
+    scenarios = {
+        'index': lambda: anonymous.get('/'),
+        'page': lambda: anonymous.get(f'/page/{rng.choice(published)}'),
+        'login': login_once,
+        'admin_pages': lambda: admin.get('/admin/pages'),
+        'admin_media': lambda: admin.get('/admin/media'),
+        'admin_users': lambda: admin.get('/admin/users'),
+        'media_upload': lambda: admin.post('/admin/media/upload', {'file_type': 'image', 'alt_text': 'bench'},
+                                           {'file': ('bench.png', _image_bytes(rng), 'image/png')}),
+    }
+    selected = args.only or SCENARIOS
+    results = {}
+    for name in selected:
+        requests = args.requests if name not in ('login', 'media_upload') else max(1, args.requests // 10)
+        results[name] = measure(name, scenarios[name], counter, requests, args.warmup)
+        r = results[name]
+        print(f"{name:14} {r['rps']:>9.1f} req/s  p50 {r['p50_ms']:>8.2f} ms  p95 {r['p95_ms']:>8.2f} ms  "
+              f"p99 {r['p99_ms']:>8.2f} ms  {r['queries_per_request']:>6.2f} q/req", file=sys.stderr)
+
+    for client in (anonymous, admin, login_client):
+        if isinstance(client, HTTPClient):
+            client.close()
+
+    output = {
+        'meta': {
+            'commit': _git_commit(),
+            'date': datetime.utcnow().isoformat(timespec='seconds'),
+            'scale': args.scale,
+            'counts': counts,
+            'mode': 'server' if args.server else 'in-process',
+            'seed': args.seed,
+            'overrides': _parse_overrides(args.set),
+            'python': platform.python_version(),
+        },
+        'results': results,
+    }
+    text = json.dumps(output, indent=2, sort_keys=True)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+# Run in a fresh interpreter, like a newly started worker
+STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+status = app.test_client().get(sys.argv[1]).status_code
+done = time.perf_counter()
+print(json.dumps({'status': status, 'import_ms': (imported - started) * 1000,
+                  'create_app_ms': (created - imported) * 1000, 'first_request_ms': (done - created) * 1000}))
+"""
+
+
+def startup(args):
+    from config import Config
+    from app import create_app
+    from app.templating import precompile_templates
+
+    workdir = tempfile.mkdtemp(prefix='cms-startup-')
+    template_cache = os.path.join(workdir, 'template_cache')
+    env = dict(os.environ,
+               DATABASE_URL='sqlite:///' + os.path.join(workdir, 'bench.db'),
+               UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+               PAGE_CACHE_DIR=os.path.join(workdir, 'page_cache'))
+    overrides = {'SQLALCHEMY_DATABASE_URI': env['DATABASE_URL'], 'UPLOAD_FOLDER': env['UPLOAD_FOLDER'],
+                 'TEMPLATE_CACHE_DIR': template_cache}
+    app = create_app(type('BenchConfig', (Config,), overrides))
+    seed(app, pages=args.pages, media=0, users=1, seed=42)
+    with app.app_context():
+        precompile_templates(app)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    for name, cache_dir in (('cold', ''), ('warm', template_cache)):
+        runs = []
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, '-c', STARTUP_PROBE, args.path], cwd=root, check=True,
+                                    env=dict(env, TEMPLATE_CACHE_DIR=cache_dir),
+                                    capture_output=True, text=True).stdout
+            run = json.loads(output.strip().splitlines()[-1])
+            if run.pop('status') != 200:
+                raise SystemExit(f'{args.path} did not answer 200')
+            run['total_ms'] = sum(run.values())
+            runs.append(run)
+        results[name] = {key: round(statistics.median(r[key] for r in runs), 2) for key in runs[0]}
+        r = results[name]
+        print(f"{name:5} import {r['import_ms']:>7.1f} ms  create_app {r['create_app_ms']:>7.1f} ms  "
+              f"first request {r['first_request_ms']:>7.1f} ms  total {r['total_ms']:>7.1f} ms", file=sys.stderr)
+
+    print(json.dumps({'meta': {'commit': _git_commit(), 'runs': args.runs, 'path': args.path,
+                               'budget_ms': args.budget_ms},
+                      'results': results}, indent=2, sort_keys=True))
+    if args.budget_ms and results['warm']['total_ms'] > args.budget_ms:
+        print(f"Warm start {results['warm']['total_ms']:.0f} ms exceeds the {args.budget_ms} ms budget",
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"before: {before['meta'].get('commit')} ({before['meta'].get('scale')}, {before['meta'].get('mode')})")
+    print(f"after:  {after['meta'].get('commit')} ({after['meta'].get('scale')}, {after['meta'].get('mode')})")
+    print(f"{'scenario':14} {'metric':20} {'before':>10} {'after':>10} {'change':>8}")
+
+    regressions = 0
+    # Higher is better for throughput, lower for everything else
+    metrics = [('rps', True), ('p50_ms', False), ('p95_ms', False), ('p99_ms', False),
+               ('queries_per_request', False)]
+    for name in sorted(set(before['results']) & set(after['results'])):
+        for metric, higher_is_better in metrics:
+            old, new = before['results'][name][metric], after['results'][name][metric]
+            change = (new - old) / old * 100 if old else 0.0
+            worse = change < -args.threshold if higher_is_better else change > args.threshold
+            if metric == 'queries_per_request':
+                worse = new > old
+            regressions += worse
+            flag = '  REGRESSION' if worse else ''
+            print(f'{name:14} {metric:20} {old:>10} {new:>10} {change:>+7.1f}%{flag}')
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='seed a database and benchmark the app')
+    run_parser.add_argument('--scale', choices=SCALES, default='small')
+    run_parser.add_argument('--pages', type=int, help='override the page count of the scale')
+    run_parser.add_argument('--media', type=int, help='override the media count of the scale')
+    run_parser.add_argument('--users', type=int, help='override the user count of the scale')
+    run_parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    run_parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per scenario')
+    run_parser.add_argument('--server', action='store_true', help='go through a local HTTP server')
+    run_parser.add_argument('--only', nargs='+', choices=SCENARIOS, help='scenarios to run')
+    run_parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                            help='config override (JSON value), e.g. PAGE_CACHE_TYPE=null')
+    run_parser.add_argument('--seed', type=int, default=42, help='random seed')
+    run_parser.add_argument('--out', help='write the JSON results to this file')
+
+    compare_parser = commands.add_parser('compare', help='diff two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help='allowed change in percent before flagging a regression')
+
+    startup_parser = commands.add_parser('startup', help='measure the cold start of a worker')
+    startup_parser.add_argument('--runs', type=int, default=5, help='processes started per variant')
+    startup_parser.add_argument('--path', default='/', help='URL of the first request')
+    startup_parser.add_argument('--pages', type=int, default=100, help='pages in the seeded database')
+    startup_parser.add_argument('--budget-ms', type=float, default=2000.0,
+                                help='maximum warm start (import + create_app + first request)')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'startup':
+        sys.exit(startup(args))
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,126 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///cms.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Pragmas applied to each SQLite connection. WAL lets public pages read
+    # while an admin save is written; synchronous=NORMAL is durable in WAL
+    # mode except for the last commits on power loss. '' leaves a default
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT = os.environ.get('SQLITE_BUSY_TIMEOUT', '5000')  # ms to wait for a lock
+    SQLITE_CACHE_SIZE = os.environ.get('SQLITE_CACHE_SIZE', '-20000')  # negative: KiB
+    SQLITE_MMAP_SIZE = os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))
+
+    # Connection pool of each worker process (PostgreSQL, MySQL)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+    # Read replica used by the public pages and search; admin writes and
+    # everything else go to DATABASE_URL
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL') or None
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or 'app/static/uploads'
+
+    # Apply pending migrations when the app starts (development convenience);
+    # otherwise run `flask db upgrade` when deploying
+    SCHEMA_AUTO_UPGRADE = os.environ.get('SCHEMA_AUTO_UPGRADE', '').lower() in ('1', 'true', 'yes')
+
+    # Compiled templates are cached on disk (defaults to instance/template_cache),
+    # fill it with `flask precompile-templates` at deploy time; '' disables it
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+
+    # Uploads are served by /media/<path>. Set MEDIA_SENDFILE to 'x-sendfile'
+    # (Apache, lighttpd) or 'x-accel-redirect' (nginx, with an internal
+    # location at MEDIA_ACCEL_PREFIX aliased to UPLOAD_FOLDER) so the front
+    # server sends the bytes instead of a Python worker
+    MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+    MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX') or '/protected-media/'
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB max
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'svg'}
+
+    # Bulk upload (/admin/media/upload/bulk): files copied and hashed in
+    # parallel, and the largest total size accepted once zip archives are
+    # expanded (the request itself is limited by MAX_CONTENT_LENGTH)
+    MEDIA_UPLOAD_WORKERS = int(os.environ.get('MEDIA_UPLOAD_WORKERS', 4))
+    MEDIA_ZIP_MAX_SIZE = int(os.environ.get('MEDIA_ZIP_MAX_SIZE', 512 * 1024 * 1024))
+
+    # Rendered page cache for anonymous visitors: 'memory' (per process),
+    # 'filesystem' (shared by all workers of a host) or 'null' (disabled)
+    PAGE_CACHE_TYPE = os.environ.get('PAGE_CACHE_TYPE') or 'memory'
+    PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 1024))
+    PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR')  # defaults to instance/page_cache
+
+    # How often (ms) each worker re-reads the site version from the database;
+    # 0 checks on every request
+    SITE_VERSION_CHECK_INTERVAL = int(os.environ.get('SITE_VERSION_CHECK_INTERVAL', 1000))
+
+    # gzip/brotli compression of text responses (HTML, CSS, JSON, XML) of at
+    # least COMPRESSION_MIN_SIZE bytes, negotiated with Accept-Encoding
+    COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', '1').lower() not in ('0', 'false', 'no')
+    COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 500))
+
+    # Users loaded by Flask-Login: 'memory' (per worker), 'filesystem'
+    # (shared by all workers of a host) or 'null' (query on every request).
+    # Changes made in another worker are seen with the site version
+    # (SITE_VERSION_CHECK_INTERVAL), entries expire after USER_CACHE_TTL
+    USER_CACHE_TYPE = os.environ.get('USER_CACHE_TYPE') or 'memory'
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 1024))
+    USER_CACHE_DIR = os.environ.get('USER_CACHE_DIR')  # defaults to instance/user_cache
+
+    # Cache-Control sent with public pages along with their ETag/Last-Modified,
+    # e.g. 'public, max-age=0, s-maxage=60' to let a CDN keep pages for a minute
+    PAGE_CACHE_CONTROL = os.environ.get('PAGE_CACHE_CONTROL') or 'public, no-cache'
+
+    # Resized copies generated in the background for each uploaded image,
+    # as {name: max width in pixels}, in each of MEDIA_DERIVATIVE_FORMATS
+    MEDIA_DERIVATIVE_SIZES = {'thumb': 320, 'small': 640, 'medium': 1280, 'large': 1920}
+    MEDIA_DERIVATIVE_FORMATS = ['webp']  # 'avif' requires a Pillow AVIF plugin
+    MEDIA_DERIVATIVE_QUALITY = int(os.environ.get('MEDIA_DERIVATIVE_QUALITY', 80))
+
+    # Background jobs (derivatives, file removal) stored in the job table.
+    # JOBS_EXECUTOR='thread' runs them in each app process; 'none' leaves
+    # them to a separate `flask jobs work` process
+    JOBS_EXECUTOR = os.environ.get('JOBS_EXECUTOR') or 'thread'
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+    JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', 1.0))
+    JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 5))
+    JOBS_RETRY_DELAY = int(os.environ.get('JOBS_RETRY_DELAY', 5))  # seconds, doubled after each failure
+    JOBS_RETRY_MAX_DELAY = int(os.environ.get('JOBS_RETRY_MAX_DELAY', 3600))
+    JOBS_TIMEOUT = int(os.environ.get('JOBS_TIMEOUT', 600))  # running longer: worker presumed dead
+    JOBS_KEEP_DAYS = int(os.environ.get('JOBS_KEEP_DAYS', 7))  # finished jobs kept for the admin page
+
+    # Rows per page in the admin lists (?per_page= is capped at the maximum)
+    ADMIN_PAGE_SIZE = int(os.environ.get('ADMIN_PAGE_SIZE', 50))
+    ADMIN_MAX_PAGE_SIZE = int(os.environ.get('ADMIN_MAX_PAGE_SIZE', 200))
+
+    # sitemap.xml becomes an index of sitemap-<n>.xml files past this many
+    # URLs (the protocol limit); FEED_SIZE pages are listed in /feed.atom.
+    # Both are generated once per admin change into SITEMAP_DIR
+    # (defaults to instance/sitemaps), with URLs on SITE_URL (e.g.
+    # https://www.example.com) or SERVER_NAME. Required in production:
+    # without either they are generated on every request instead of
+    # cached, and a warning is logged at startup
+    SITE_URL = os.environ.get('SITE_URL')
+    SITEMAP_MAX_URLS = int(os.environ.get('SITEMAP_MAX_URLS', 50000))
+    SITEMAP_DIR = os.environ.get('SITEMAP_DIR')
+    FEED_SIZE = int(os.environ.get('FEED_SIZE', 20))
+
+    # Results per page of the public search (/search)
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+
+    # JSON API (/api): pages per list call (?per_page= is capped at the
+    # maximum) and slugs/ids accepted by one batched lookup
+    API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 50))
+    API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 200))
+    API_MAX_BATCH = int(os.environ.get('API_MAX_BATCH', 100))
+
+    # Request/SQL/template instrumentation, exposed at /admin/metrics.
+    # METRICS_SAMPLE_RATE is the fraction of requests measured (0.0-1.0),
+    # METRICS_SLOW_REQUEST_MS logs slower requests with their queries (0 = off)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+    METRICS_SLOW_REQUEST_MS = int(os.environ.get('METRICS_SLOW_REQUEST_MS', 0))
+    METRICS_N_PLUS_ONE_THRESHOLD = int(os.environ.get('METRICS_N_PLUS_ONE_THRESHOLD', 10))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # bearer token for scrapers
@@ -0,0 +1,46 @@
+"""
+Gunicorn settings for production
+
+    gunicorn -c gunicorn.conf.py run:app
+    python run.py --production            # same settings
+
+The app is imported once in the master process (preload_app) and each
+worker is forked from it, sharing the loaded code copy-on-write. Send
+HUP to the master for a graceful restart of the workers with new
+settings; code changes need a fresh master (USR2 then QUIT the old one).
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('WEB_BIND') or '0.0.0.0:8000'
+workers = int(os.environ.get('WEB_WORKERS') or multiprocessing.cpu_count() * 2 + 1)
+threads = int(os.environ.get('WEB_THREADS') or 4)
+worker_class = 'gthread'
+preload_app = True
+
+# Seconds a worker may spend on a request, and to finish them on restart
+timeout = int(os.environ.get('WEB_TIMEOUT') or 60)
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT') or 30)
+keepalive = 5
+
+# Recycle workers now and then so memory growth cannot accumulate
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS') or 10000)
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('WEB_ACCESS_LOG') or '-'
+
+
+def when_ready(server):
+    """Compile the templates in the master so workers inherit them"""
+    from app.templating import precompile_templates
+    precompile_templates(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    """Drop database connections inherited from the master"""
+    from app import db
+    app = server.app.wsgi()
+    with app.app_context():
+        # close=False: the master still owns those sockets
+        for engine in db.engines.values():
+            engine.dispose(close=False)
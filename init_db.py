@@ -1,12 +1,165 @@
 #!/usr/bin/env python3
 """
 Initialize the database with sample data
+
+    python init_db.py                                  # admin, theme and 3 sample pages
+    python init_db.py --pages 1000000 --media 50000 --users 1000 --seed 42
+
+With counts, realistic generated users, pages and media records are bulk
+inserted on top of the sample data, for performance work at production scale.
 """
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select
 from app import create_app, db
-from app.models import User, Page, Theme
+from app.models import User, Page, Media, Theme, SiteState
+from app.migrations import upgrade
+from app.search import rebuild_search_index
+from app.stats import reconcile
+
+WORDS = (
+    'site web page contenu service produit client projet équipe accueil actualité événement '
+    'galerie contact offre solution conseil expertise qualité innovation développement design '
+    'communication formation atelier ressource guide question réponse article histoire mission '
+    'valeur partenaire collection saison catalogue boutique réalisation technique nature ville'
+).split()
+
+MIME_TYPES = [('jpg', 'image/jpeg', 60), ('png', 'image/png', 25), ('webp', 'image/webp', 10),
+              ('gif', 'image/gif', 3), ('svg', 'image/svg+xml', 2)]
+
+MENU_SIZE = 8
+
+
+def _title(rng):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(2, 6))).capitalize()
+
+
+def _slugify(text):
+    table = str.maketrans('àâäéèêëîïôöùûüç', 'aaaeeeeiioouuuc')
+    return '-'.join(text.lower().translate(table).split())
+
+
+def _paragraph_pool(rng, size=500):
+    return [
+        '<p>' + ' '.join(rng.choices(WORDS, k=rng.randint(20, 120))).capitalize() + '.</p>'
+        for _ in range(size)
+    ]
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _user_rows(rng, count, password_hash, start, span):
+    for i in range(count):
+        created_at = start + timedelta(seconds=rng.randrange(span))
+        yield {
+            'username': f'user{i}',
+            'email': f'user{i}@example.com',
+            'password_hash': password_hash,
+            'is_admin': rng.random() < 0.05,
+            'created_at': created_at,
+        }
+
 
-def init_database():
-    """Initialize database with sample data"""
+def _page_rows(rng, count, author_ids, start, span):
+    paragraphs = _paragraph_pool(rng)
+    menu_left = MENU_SIZE
+    for i in range(count):
+        title = _title(rng)
+        # Mostly short pages with a long tail of very large ones
+        length = min(200, int(rng.paretovariate(1.3)))
+        is_published = rng.random() < 0.85
+        show_in_menu = is_published and menu_left > 0
+        menu_left -= show_in_menu
+        created_at = start + timedelta(seconds=rng.randrange(span))
+        yield {
+            'title': title,
+            'slug': f'{_slugify(title)}-{i}',
+            'content': ''.join(rng.choices(paragraphs, k=length)),
+            'is_published': is_published,
+            'show_in_menu': show_in_menu,
+            'menu_order': MENU_SIZE - menu_left if show_in_menu else 0,
+            'created_at': created_at,
+            'updated_at': created_at + timedelta(seconds=rng.randrange(span // 10)),
+            'created_by_id': rng.choice(author_ids),
+        }
+
+
+def _media_rows(rng, count, author_ids, start, span):
+    extensions, mime_types, weights = zip(*[(e, m, w) for e, m, w in MIME_TYPES])
+    for i in range(count):
+        index = rng.choices(range(len(extensions)), weights=weights)[0]
+        filename = f'generated_{i}.{extensions[index]}'
+        width = rng.choice((640, 800, 1024, 1920, 3000, 4000, 6000))
+        yield {
+            'filename': filename,
+            'original_filename': f'{_slugify(_title(rng))}.{extensions[index]}',
+            'file_path': f'app/static/uploads/{filename}',
+            'file_type': rng.choices(('image', 'photo', 'logo', 'icon'), weights=(60, 30, 5, 5))[0],
+            'mime_type': mime_types[index],
+            'file_size': int(min(15_000_000, rng.lognormvariate(13, 1.2))),
+            'alt_text': _title(rng) if rng.random() < 0.6 else None,
+            'width': width,
+            'height': width * rng.choice((9, 10, 12, 16)) // 16,
+            'uploaded_at': start + timedelta(seconds=rng.randrange(span)),
+            'uploaded_by_id': rng.choice(author_ids),
+        }
+
+
+def generate_bulk_data(users=0, pages=0, media=0, seed=42, batch_size=10000, log=print):
+    """Bulk insert generated users, pages and media records (inside an app context)
+
+    Uses one transaction and executemany batches instead of ORM objects, so
+    a million pages take a couple of minutes on SQLite.
+    """
+    rng = random.Random(seed)
+    start = datetime.utcnow() - timedelta(days=3 * 365)
+    span = 3 * 365 * 24 * 3600
+
+    admin = User.query.filter_by(is_admin=True).first()
+    password_hash = admin.password_hash if admin else ''
+
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'sqlite':
+            # Durability is pointless for throwaway generated data; the pragma
+            # only lasts as long as this script's connection
+            connection.exec_driver_sql('PRAGMA synchronous = OFF')
+
+        _insert(connection, 'users', User.__table__, _user_rows(rng, users, password_hash, start, span),
+                users, batch_size, log)
+
+        author_ids = [row.id for row in connection.execute(select(User.id).where(User.is_admin.is_(True)))]
+        author_ids = author_ids or [None]
+        _insert(connection, 'pages', Page.__table__, _page_rows(rng, pages, author_ids, start, span),
+                pages, batch_size, log)
+        _insert(connection, 'media', Media.__table__, _media_rows(rng, media, author_ids, start, span),
+                media, batch_size, log)
+
+
+def _insert(connection, label, table, rows, total, batch_size, log):
+    if not total:
+        return
+    started = time.perf_counter()
+    done = 0
+    for batch in _batches(rows, batch_size):
+        connection.execute(table.insert(), batch)
+        done += len(batch)
+        if done % (batch_size * 10) == 0 or done == total:
+            log(f"  {label}: {done}/{total} ({time.perf_counter() - started:.1f}s)")
+
+
+def init_database(users=0, pages=0, media=0, seed=42, batch_size=10000):
+    """Initialize database with sample data, plus generated data if counts are given"""
     app = create_app()
 
     with app.app_context():
@@ -15,7 +168,7 @@ def init_database():
         db.drop_all()
 
         print("Creating new tables...")
-        db.create_all()
+        upgrade()
 
         # Create admin user
         print("Creating admin user...")
@@ -39,6 +192,7 @@ def init_database():
             footer_text='© 2024 Mon Site Web. Tous droits réservés.'
         )
         db.session.add(theme)
+        db.session.add(SiteState(id=1, version=1))
 
         # Create sample pages
         print("Creating sample pages...")
@@ -117,6 +271,19 @@ def init_database():
         # Commit all changes
         db.session.commit()
 
+        if users or pages or media:
+            print(f"Generating {users} users, {pages} pages and {media} media (seed {seed})...")
+            generate_bulk_data(users=users, pages=pages, media=media, seed=seed, batch_size=batch_size)
+
+        print("Indexing pages for search...")
+        with db.engine.begin() as connection:
+            rebuild_search_index(connection)
+
+        # Generated rows are inserted without the ORM, recount them
+        print("Counting content for the dashboard...")
+        with db.engine.begin() as connection:
+            reconcile(connection)
+
         print("\n" + "="*50)
         print("Database initialized successfully!")
         print("="*50)
@@ -127,4 +294,12 @@ def init_database():
         print("="*50)
 
 if __name__ == '__main__':
-    init_database()
+    parser = argparse.ArgumentParser(description='Initialize the database (drops existing tables).')
+    parser.add_argument('--users', type=int, default=0, help='generated users to add')
+    parser.add_argument('--pages', type=int, default=0, help='generated pages to add')
+    parser.add_argument('--media', type=int, default=0, help='generated media records to add (no files)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed, same seed gives same data')
+    parser.add_argument('--batch-size', type=int, default=10000, help='rows per bulk insert')
+    args = parser.parse_args()
+    init_database(users=args.users, pages=args.pages, media=args.media,
+                  seed=args.seed, batch_size=args.batch_size)
@@ -1,10 +1,53 @@
 #!/usr/bin/env python3
 """
 Application launcher for the CMS
+
+    python run.py                                  # development server (debug, reloader)
+    python run.py --production [--workers 8] [--threads 4] [--bind 0.0.0.0:8000]
+
+The production mode runs gunicorn with the settings of gunicorn.conf.py,
+command-line options taking precedence.
 """
+import argparse
+import os
 from app import create_app
 
 app = create_app()
 
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+
+def serve_production(bind=None, workers=None, threads=None):
+    from gunicorn.app.base import Application
+
+    overrides = {'bind': bind, 'workers': workers, 'threads': threads}
+
+    class ProductionServer(Application):
+        def init(self, parser, opts, args):
+            return None
+
+        def load_config(self):
+            self.load_config_from_file(CONFIG_FILE)
+            for key, value in overrides.items():
+                if value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            # Already created above, before the workers are forked
+            return app
+
+    ProductionServer().run()
+
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    parser = argparse.ArgumentParser(description='Run the CMS web server.')
+    parser.add_argument('--production', action='store_true', help='serve with gunicorn (multi-process)')
+    parser.add_argument('--bind', help='address:port to listen on (production)')
+    parser.add_argument('--workers', type=int, help='worker processes (production)')
+    parser.add_argument('--threads', type=int, help='threads per worker (production)')
+    args = parser.parse_args()
+
+    if args.production:
+        serve_production(args.bind, args.workers, args.threads)
+    else:
+        app.run(debug=True, host='0.0.0.0', port=5000)
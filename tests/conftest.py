@@ -0,0 +1,27 @@
+"""Shared fixtures: the app on a temporary SQLite database built by the migrations"""
+import pytest
+from config import Config
+
+
+@pytest.fixture
+def app(tmp_path):
+    from app import create_app
+    from app.migrations import upgrade
+
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        DATABASE_REPLICA_URL = None
+        SCHEMA_AUTO_UPGRADE = False
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+        TEMPLATE_CACHE_DIR = str(tmp_path / 'template_cache')
+        PAGE_CACHE_TYPE = 'null'
+        USER_CACHE_TYPE = 'null'
+        SITEMAP_DIR = str(tmp_path / 'sitemaps')
+        SITE_URL = 'https://www.example.com'
+        JOBS_EXECUTOR = 'none'
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        upgrade()
+        yield app
@@ -0,0 +1,14 @@
+"""Every hot query shape is served by an index (EXPLAIN QUERY PLAN)"""
+from app.migrations import explain, hot_queries, is_full_scan, is_seek
+
+
+def test_hot_queries_use_an_index(app):
+    failures = []
+    for name, query in hot_queries().items():
+        query, index = query if isinstance(query, tuple) else (query, None)
+        plan = explain(query)
+        if any(is_full_scan(line) for line in plan):
+            failures.append(f'{name}: full scan: {" | ".join(plan)}')
+        if index is not None and not any(is_seek(line, index) for line in plan):
+            failures.append(f'{name}: no range search on {index}: {" | ".join(plan)}')
+    assert not failures, '\n'.join(failures)
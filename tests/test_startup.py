@@ -0,0 +1,38 @@
+"""A new worker starts within the budget (imports, create_app, first request)"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import pytest
+from benchmarks.bench import STARTUP_PROBE
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Same default as `bench.py startup`, raise it on slow CI machines
+BUDGET_MS = float(os.environ.get('STARTUP_BUDGET_MS', 2000))
+RUNS = 3
+
+
+@pytest.mark.slow
+def test_warm_start_within_budget(app):
+    from app.templating import precompile_templates
+    precompile_templates(app)
+    config = app.config
+    env = dict(os.environ,
+               DATABASE_URL=config['SQLALCHEMY_DATABASE_URI'],
+               UPLOAD_FOLDER=config['UPLOAD_FOLDER'],
+               TEMPLATE_CACHE_DIR=config['TEMPLATE_CACHE_DIR'],
+               SITEMAP_DIR=config['SITEMAP_DIR'],
+               SITE_URL=config['SITE_URL'],
+               JOBS_EXECUTOR='none')
+
+    totals = []
+    for _ in range(RUNS):
+        output = subprocess.run([sys.executable, '-c', STARTUP_PROBE, '/'], cwd=ROOT, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        run = json.loads(output.strip().splitlines()[-1])
+        assert run.pop('status') == 200
+        totals.append(sum(run.values()))
+
+    assert statistics.median(totals) <= BUDGET_MS, f'warm start {statistics.median(totals):.0f} ms > {BUDGET_MS:.0f} ms'